@@ -0,0 +1,228 @@
+"""
+Micro-benchmarks for the resolution machinery
+"""
+
+import gc
+import sys
+import time
+from types import ModuleType
+from nltk import data
+from nltk.sem import Valuation
+from nltk.inference.mace import MaceCommand
+import test
+from util import Tester, UngrammaticalException
+from nltk.inference.prover9 import convert_to_prover9
+from inference import mace_valuation, remove_temporal_conds, SyntacticCheck
+from temporaldrt import DrtParser
+from presuppdrt import AbstractDrs, DRS, Reading, DiscourseBuilder
+
+GRAMMAR = 'file:../data/grammar.fcfg'
+
+SENTENCES = [
+    "Angus owns a car",
+    "Mary kissed John",
+    "He smiled",
+    "If John owns a car he is rich",
+    "John bought a fancy car",
+    "He was rich",
+    "Angus does not own a car",
+    "A dog bit Angus",
+    "Jones loves Charlotte and Bill loves her",
+    "Mia is away",
+    ]
+
+def discourse(tester, length):
+    """A discourse of the given number of sentences, repeating SENTENCES"""
+    sentences = (SENTENCES * (length / len(SENTENCES) + 1))[:length]
+    return tester.parse(". ".join(sentences))
+
+def timed(function, repeat=10):
+    """@return: the best time of the given number of runs, in milliseconds"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def bench_reading_application(tester):
+    """Applying a reading to a discourse of 50 sentences. The operations are
+    looked up in a table indexed by DRS, so the time spent on deepcopy()
+    does not grow with the number of operations of the reading"""
+    for length in [10, 25, 50]:
+        expression = discourse(tester, length)
+        reading = expression.readings()[0][0]
+        print "%2d sentences, %3d conditions:\tdeepcopy %8.2f ms\tapply_operations %8.2f ms" % \
+            (length, len(expression.conds), timed(lambda: expression.deepcopy(reading)),
+             timed(lambda: expression.apply_operations(reading)))
+
+    expression = discourse(tester, 50)
+    reading = expression.readings()[0][0]
+    for padding in [0, 10, 100, 1000]:
+        # operations on DRSs outside the discourse are never executed
+        padded = Reading(reading + [(DRS([], []), None) for i in range(padding)])
+        print "%4d operations:\tdeepcopy %8.2f ms" % (len(padded), timed(lambda: expression.deepcopy(padded)))
+
+def bench_discourse_building(tester):
+    """Merging the DRSs of the sentences of a discourse, by simplifying the
+    concatenation with the discourse and with a L{DiscourseBuilder}"""
+    sentence_drss = [tester.parse(sentence, utter=False) for sentence in SENTENCES]
+    for length in [10, 30, 100]:
+        drss = (sentence_drss * (length / len(SENTENCES) + 1))[:length]
+        def concatenate():
+            drs = drss[0]
+            for sentence_drs in drss[1:]:
+                drs = (drs + sentence_drs).simplify()
+        def build():
+            discourse = DiscourseBuilder()
+            for sentence_drs in drss:
+                discourse.append(sentence_drs)
+            discourse.drs()
+        print "%3d sentences:\tconcatenation %8.2f ms\tDiscourseBuilder %8.2f ms" % \
+            (length, timed(concatenate, repeat=3), timed(build, repeat=3))
+
+def bench_tester(tester):
+    """Building a Tester, with the grammar loaded the way every Tester did
+    before Tester.load_grammar() kept it and with the grammar kept"""
+    print "loading the grammar:\t%8.2f ms" % \
+        timed(lambda: data.load(GRAMMAR, cache=False, logic_parser=DrtParser()), repeat=3)
+    print "new Tester:\t\t%8.2f ms" % timed(lambda: Tester(GRAMMAR, DrtParser))
+
+class SentenceCollector(object):
+    """Stands in for the Tester in the test functions of test.py, to
+    collect the sentences they parse"""
+    def __init__(self):
+        self.texts = []
+
+    def test(self, cases, **args):
+        self.texts.extend([sentence for number, sentence, expected in cases])
+
+    def inference_test(self, cases, bk, verbose=False):
+        for number, discourse, expression, judgement in cases:
+            self.texts.extend([text for text in [discourse, expression] if text])
+
+    def concatenation_test(self, cases):
+        for number, discourse, expression in cases:
+            self.texts.extend([discourse, expression])
+
+def bench_first_parse(tester):
+    """Parsing the sentences of test.py, stopping at the first parse of
+    each sentence and building the chart of all the parses. Only the
+    ambiguous sentences gain much, and few of them are ambiguous."""
+    collector = SentenceCollector()
+    for header, function in test.TESTS:
+        function(collector)
+    sentences = []
+    for text in collector.texts:
+        sentences.extend([sentence for sentence in text.split('.') if sentence.strip()])
+    def parse(parses):
+        for sentence in sentences:
+            try:
+                tester.parse(sentence, utter=False, parses=parses)
+            except (UngrammaticalException, ValueError):
+                # sentences not covered by the grammar, as in test.py
+                pass
+    ambiguous = 0
+    for sentence in sentences:
+        try:
+            if len(tester.parser.nbest_parse(tester._split(sentence.lstrip()))) > 1:
+                ambiguous += 1
+        except ValueError:
+            pass
+    first_time = timed(lambda: parse(1), repeat=3)
+    all_time = timed(lambda: parse(None), repeat=3)
+    print "%d sentences (%d ambiguous):\tfirst parse %8.2f ms\tall parses %8.2f ms\tgain %4.1f%%" % \
+        (len(sentences), ambiguous, first_time, all_time, 100 * (all_time - first_time) / all_time)
+
+def mace_output(size):
+    """Mace4 output of a model of the given size, with as many constants,
+    properties and two-place relations as there are entities"""
+    cells = lambda arity: ", ".join([str((cell * 7) % 3 % 2) for cell in range(size ** arity)])
+    symbols = ["function(c%d, [ %d ])" % (i, i) for i in range(size)] + \
+              ["relation(p%d(_), [ %s ])" % (i, cells(1)) for i in range(size)] + \
+              ["relation(r%d(_,_), [\n\t%s ])" % (i, cells(2)) for i in range(size)]
+    return "interpretation( %d, [number=1, seconds=0], [\n\n        %s\n]).\n" % \
+        (size, ",\n\n        ".join(symbols))
+
+def bench_model(tester):
+    """Building the Valuation of a model from the raw output of Mace4, and
+    with a relation set built per table from the output of interpformat
+    standard (the tables already parsed, the process itself not included)"""
+    for size in [2, 5, 10, 20]:
+        output = mace_output(size)
+        tables = [[int(value) for value in line[line.index('[') + 1:line.index(']')].split(',')]
+                  for line in output.replace("\n\t", " ").splitlines() if line.strip().startswith('relation')]
+        names = ["r%d" % i for i in range(len(tables))]
+        relation_sets = lambda: Valuation([(name, MaceCommand._make_relation_set(size, values))
+                                           for name, values in zip(names, tables)])
+        print "%2d entities:\tmace_valuation %8.2f ms\t_make_relation_set %8.2f ms" % \
+            (size, timed(lambda: mace_valuation(output)), timed(relation_sets))
+
+def bench_syntactic_check(tester):
+    """Deciding the consistency of a discourse with a L{SyntacticCheck},
+    against converting it to the Prover9 input of the check, which is
+    only where a prover check starts (nltk runs out of stack converting
+    longer discourses)"""
+    for length in [10, 20, 30]:
+        expression, error = discourse(tester, length).iter_readings(limit=1).next()
+        remove_temporal_conds(expression)
+        print "%3d conditions:\tSyntacticCheck %8.2f ms\tconvert_to_prover9 %8.2f ms\tverdict %s" % \
+            (len(expression.conds), timed(lambda: SyntacticCheck(expression).verdict()),
+             timed(lambda: convert_to_prover9(expression.fol())), SyntacticCheck(expression).verdict())
+
+def reachable(expression):
+    """@return: the objects reachable from the expression, but for classes and modules"""
+    seen = {}
+    stack = [expression]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, ModuleType)):
+            continue
+        seen[id(obj)] = obj
+        stack.extend(gc.get_referents(obj))
+    return seen.values()
+
+def bench_memory(tester):
+    """Bytes per condition taken by the DRS of a discourse, with the
+    attributes of the expressions in slots and with a __dict__ allocated
+    for every expression, as when they were kept in one. Runs last: the
+    expressions shared with the grammar keep their __dict__"""
+    expressions = [discourse(tester, length) for length in [10, 30, 100]]
+    slotted = [sum([sys.getsizeof(obj) for obj in reachable(expression)]) for expression in expressions]
+    for expression in expressions:
+        for obj in reachable(expression):
+            if isinstance(obj, AbstractDrs):
+                obj.__dict__
+    for expression, slotted_size in zip(expressions, slotted):
+        dict_size = sum([sys.getsizeof(obj) for obj in reachable(expression)])
+        print "%3d conditions:\tslots %6d bytes/condition\t__dict__ %6d bytes/condition" % \
+            (len(expression.conds), slotted_size / len(expression.conds), dict_size / len(expression.conds))
+
+HASH_LINE = "#" * 80
+
+def print_header(header):
+    len_hash = (74 - len(header)) / 2
+    print "\n\t# {0} #\n\t### {1} {2} {1} ###\n\t# {0} #\n\n".format(HASH_LINE, "#" * len_hash, header)
+
+BENCHMARKS = [("Tester creation", bench_tester),
+              ("Reading application", bench_reading_application),
+              ("first parse", bench_first_parse),
+              ("discourse building", bench_discourse_building),
+              ("model building", bench_model),
+              ("syntactic checks", bench_syntactic_check),
+              ("memory", bench_memory),
+              ]
+
+def main():
+    print_header("Loading grammars")
+    Tester.preload([(GRAMMAR, DrtParser)], verbose=True)
+    tester = Tester(GRAMMAR, DrtParser)
+    for header, benchmark in BENCHMARKS:
+        print_header("Benchmarking %s" % header)
+        benchmark(tester)
+    print "\n\t{0} THE  END {0}".format("#" * 37)
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,8 @@ import random
 from test import BK
 from util import Tester, UngrammaticalException
 from temporaldrt import DrtParser
-from inference import AdmissibilityError, ConsistencyError, InformativityError
+from presuppdrt import simplified
+from inference import AdmissibilityError, ConsistencyError, InformativityError, InferenceSession
 
 class Curt(object):
     INADMISSIBLE = ["That's Greek to me", "Do you get my drift?", "Now, hold your horses!", "Well, I dunno...", "Neither rhyme nor reason."]
@@ -22,6 +23,8 @@ class Curt(object):
         self.tester = Tester(grammar_file, logic_parser)
         self.background = background
         self.discourse = None
+        # the admitted readings, the prover only gets the new information
+        self.session = InferenceSession()
         
     def randomize(self, option_list):
         return option_list[random.randint(0, len(option_list) - 1)]
@@ -54,7 +57,16 @@ class Curt(object):
             self.discourse = self.tester.parse(utterance, utter=True)
         else:
             expression = self.tester.parse_new(self.discourse, utterance)
-            inferences, errors = self.tester.interpret_new(self.discourse, expression, background=self.background)
+            # one admissible reading is enough to accept the utterance
+            inferences = []
+            errors = []
+            for reading, error in self.tester.iter_interpretations(self.discourse, expression,
+                                                                   background=self.background, limit=1,
+                                                                   session=self.session):
+                if error is None:
+                    inferences.append(reading)
+                else:
+                    errors.append((reading, error))
             if not inferences:
                 out = []
                 for reading, error in errors:
@@ -66,10 +78,23 @@ class Curt(object):
                 if verbose:
                     for inference in inferences:
                         print "reading: %s" % inference
-                self.discourse = (self.discourse + expression).simplify()
+                self.session.admit(inferences[0])
+                self.discourse = simplified(self.discourse + expression)
 
         return self.ok()
         
+    def model(self, verbose=False):
+        """@return: a model of the discourse and the background knowledge
+        (an L{nltk.sem.Valuation}), or None if none was found"""
+        if not self.session.conds and self.discourse is not None:
+            # the first utterance is not checked, hence not admitted yet
+            for reading, error in self.discourse.iter_readings(limit=1):
+                self.session.admit(reading)
+        background_knowledge = None
+        if self.background and self.discourse is not None:
+            background_knowledge = self.tester.collect_background(self.discourse, self.background, verbose)
+        return self.session.model(background_knowledge, verbose)
+
     def __str__(self):
         return str(self.discourse)
 
@@ -77,6 +102,7 @@ def main():
     show_model = False
     explicit = False
     verbose = False
+    Tester.preload([('file:../data/grammar.fcfg', DrtParser)], verbose=True)
     curt = Curt(background=BK)
     print "Welcome to Curt, type 'h' for help"
     while True:
@@ -108,7 +134,8 @@ def main():
             except UngrammaticalException:
                 print "Curt says:\tWhat was that again?"
             if show_model:
-                print "Model: %s" % str(curt)
+                print "Discourse: %s" % str(curt)
+                print "Model: %s" % curt.model(verbose)
 
 def test_curt():
     input = ["If Mia is away Angus is out", "Mia is away", "Angus is out", "Mia is not away", "Mia is away"]
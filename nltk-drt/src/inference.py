@@ -47,44 +47,347 @@ __author__ = "Peter Makarov, Alex Kislev, Emma Li"
 __version__ = "1.0"
 __date__ = "Tue, 24 Aug 2010"
 
+import re
+import math
+import time
+import shelve
+from itertools import product
 import subprocess
-from threading import Thread
+from Queue import Queue
+from threading import Thread, Lock, Event
+from multiprocessing import cpu_count
+from workers import WorkerPool
 from nltk.internals import find_binary
 from nltk.sem import Valuation
 from nltk.sem.logic import is_indvar
 from nltk.inference.mace import MaceCommand
 from nltk.inference.prover9 import convert_to_prover9
-from nltk.sem.logic import AndExpression, NegatedExpression
+from nltk.sem.logic import AndExpression, NegatedExpression, ConstantExpression, Variable, \
+                           ApplicationExpression, EqualityExpression, AbstractVariableExpression
 from temporaldrt import DRS, DrtBooleanExpression, DrtNegatedExpression, DrtConstantExpression, \
                         DrtApplicationExpression, ReverseIterator, DrtTokens, NewInfoDRS, \
                         ConcatenationDRS, DrtImpExpression, DrtOrExpression, PresuppositionDRS, \
-                        DrtEventualityApplicationExpression
+                        DrtEventualityApplicationExpression, DrtVariableExpression
+from presuppdrt import simplified
 
 class Communicator(Thread):
-    """a thread communicating with a process, terminates once the communication is over"""
-    def __init__(self, process, input=None):
+    """a thread communicating with a process, terminates once the communication is over
+    and then sets the given event, so that the caller can block instead of polling"""
+    def __init__(self, process, input=None, finished=None):
         Thread.__init__(self)
         self.process = process
         self.input = input
+        self.finished = finished
+        self.result = (None, None)
+        self.done = False
     
     def run(self):
         try:
             self.result = self.process.communicate(self.input)
         except OSError:
             pass
+        finally:
+            # the thread is still alive when the event is set, hence the flag
+            self.done = True
+            if self.finished is not None:
+                self.finished.set()
+
+class ProverPool(WorkerPool):
+    """
+    A fixed set of worker slots running prover/builder checks, shared
+    by all L{Theorem} instances. Prover9 and Mace4 read a single problem
+    and exit, so every check still starts its own processes, but the
+    worker threads are long-lived, checks wait in a queue instead of all
+    running at once, and every check is bounded by the per-job timeout.
+    """
+    def __init__(self, size=None, timeout=None):
+        """
+        @param size: number of checks running at the same time,
+        defaults to the number of processors
+        @param timeout: maximum number of seconds a check may run, or None
+        """
+        WorkerPool.__init__(self, size or cpu_count())
+        self.timeout = timeout
+
+    def submit_theorem(self, theorem, run_builder=False, verbose=False, model=False):
+        """Queue a theorem check and return its L{workers.Job}"""
+        job = self.submit(theorem._run, run_builder, verbose, self.timeout, model)
+        job.add_cancel_callback(theorem.terminate)
+        return job
+
+    def check(self, theorem, run_builder=False, verbose=False, model=False):
+        return self.submit_theorem(theorem, run_builder, verbose, model).result()
+
+class Undecided(tuple):
+    """
+    The (result, output) of a check that neither the prover nor the builder
+    decided: they ran out of their budget, failed, or the check was cancelled
+    or timed out. It reads like the verdict it stands for, e.g. (True, None)
+    as no proof was found, but it is not cached (see L{VerdictCache.put}).
+    """
+    pass
+
+class VerdictCache(object):
+    """
+    A least-recently-used cache of prover/builder verdicts, keyed on the
+    Prover9/Mace4 input of a check. Automatically generated variables
+    (z1, e01, s01, t01, ...) are renamed in order of appearance first, so
+    that alphabetic variants of the same goal share a single entry, the same
+    way L{presuppdrt.AbstractDrs.normalize} does for expressions.
+
+    Optionally, the verdicts are also kept in a C{shelve} file, so that they
+    survive between sessions.
+    """
+    UNIQUE_VARIABLE = re.compile(r'\b(z|[est]0)\d+\b')
+
+    def __init__(self, size=10000, filename=None):
+        """
+        @param size: maximum number of verdicts kept in memory
+        @param filename: the shelve file to persist verdicts in, or None
+        """
+        assert size > 0, "A cache needs room for at least one verdict"
+        self.size = size
+        self.filename = filename
+        self._shelf = shelve.open(filename) if filename else None
+        self._lock = Lock()
+        self._entries = {}
+        # circular doubly-linked list of [previous, next, key],
+        # the most recently used entry follows the root
+        self._root = []
+        self._root[:] = [self._root, self._root, None]
+        self.stats = {'hits' : 0, 'misses' : 0, 'evictions' : 0}
+
+    @staticmethod
+    def key(text):
+        """Rename automatically generated variables in the given prover input"""
+        names = {}
+        def rename(match):
+            name = match.group(0)
+            if name not in names:
+                names[name] = "%s%s" % (match.group(1), len(names) + 1)
+            return names[name]
+        return VerdictCache.UNIQUE_VARIABLE.sub(rename, text)
+
+    def _link(self, key, link=None):
+        """Move (or add) an entry to the most recently used position"""
+        if link is None:
+            link = [None, None, key]
+        else:
+            link[0][1] = link[1]
+            link[1][0] = link[0]
+        root = self._root
+        link[0] = root
+        link[1] = root[1]
+        root[1][0] = link
+        root[1] = link
+        return link
+
+    def get(self, key):
+        """@return: the cached verdict for the key, or None"""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._link(key, entry[0])
+                self.stats['hits'] += 1
+                return entry[1]
+            if self._shelf is not None and key in self._shelf:
+                value = self._shelf[key]
+                self._store(key, value)
+                self.stats['hits'] += 1
+                return value
+            self.stats['misses'] += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """Keep the verdict for the key; an L{Undecided} result is not kept,
+        a larger budget or another run may decide the check"""
+        if isinstance(value, Undecided):
+            return
+        self._lock.acquire()
+        try:
+            self._store(key, value)
+            if self._shelf is not None:
+                self._shelf[key] = value
+        finally:
+            self._lock.release()
+
+    def _store(self, key, value):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] = value
+            self._link(key, entry[0])
+            return
+        self._entries[key] = [self._link(key), value]
+        if len(self._entries) > self.size:
+            oldest = self._root[0]
+            oldest[0][1] = self._root
+            self._root[0] = oldest[0]
+            del self._entries[oldest[2]]
+            self.stats['evictions'] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Forget all verdicts held in memory (the shelve file is kept)"""
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            self._root[:] = [self._root, self._root, None]
+        finally:
+            self._lock.release()
+
+    def statistics(self):
+        """@return: a C{dict} with the number of hits, misses and evictions"""
+        self._lock.acquire()
+        try:
+            result = dict(self.stats)
+        finally:
+            self._lock.release()
+        result['size'] = len(self._entries)
+        return result
+
+    def sync(self):
+        if self._shelf is not None:
+            self._lock.acquire()
+            try:
+                self._shelf.sync()
+            finally:
+                self._lock.release()
+
+    def close(self):
+        if self._shelf is not None:
+            self._lock.acquire()
+            try:
+                self._shelf.close()
+                self._shelf = None
+            finally:
+                self._lock.release()
+
+class BudgetSchedule(object):
+    """
+    The budgets of the checks of a L{Theorem}: the prover's max_seconds and
+    the builder's end_size, the largest domain it searches for a model. A
+    check is given a small budget first and a budget larger by the given
+    factor each time neither the prover nor the builder decided it within
+    the last one, up to the largest budget. A check takes no longer than
+    the total number of seconds however it goes: every step gets at most
+    the time that is left of it. For goals of about the same size, the
+    schedule learns the step their checks get decided at and starts the
+    next checks there.
+    """
+    def __init__(self, total=60, prover_timeout=2, end_size=10, factor=4, max_end_size=500, memory=0.25):
+        """
+        @param total: seconds a check takes at most, and the prover's
+        max_seconds at the last step
+        @param prover_timeout: seconds given to the prover first
+        @param end_size: largest domain size the builder searches first
+        @param factor: the budgets grow by this factor at each step
+        @param max_end_size: largest domain size the builder searches last
+        @param memory: weight of the last check in the learned first step
+        """
+        assert factor > 1, "The budgets have to grow"
+        self.total = total
+        self.steps = []
+        while True:
+            self.steps.append((min(prover_timeout, total), min(end_size, max_end_size)))
+            if prover_timeout >= total and end_size >= max_end_size:
+                break
+            prover_timeout *= factor
+            end_size *= factor
+        self.memory = memory
+        self._lock = Lock()
+        # average step the checks were decided at, by whether the builder
+        # ran and by size class
+        self._history = {}
+
+    @staticmethod
+    def size_class(goal):
+        """Goals are grouped by the binary order of magnitude of their length"""
+        return int(math.log(max(len(goal), 1), 2))
+
+    def start(self, goal, run_builder=False):
+        """@return: the index of the step the checks of the goal start with"""
+        self._lock.acquire()
+        try:
+            return int(self._history.get((run_builder, self.size_class(goal)), 0.0) + 0.5)
+        finally:
+            self._lock.release()
+
+    def record(self, goal, step, run_builder=False):
+        """Learn the step a check of the goal was decided at"""
+        key = (run_builder, self.size_class(goal))
+        self._lock.acquire()
+        try:
+            average = self._history.get(key, float(step))
+            self._history[key] = average + self.memory * (step - average)
+        finally:
+            self._lock.release()
+
+    def statistics(self):
+        """@return: a C{dict} of the learned first step (a C{float}) by
+        whether the builder ran and size class"""
+        self._lock.acquire()
+        try:
+            return dict(self._history)
+        finally:
+            self._lock.release()
 
 class Theorem(object):
 
     BINARY_LOCATIONS = ('/usr/local/bin', '/usr/bin', '/usr/share/prover9/bin')
     PROVER_BINARY = None
     BUILDER_BINARY = None
-    INTERPFORMAT_BINARY = None
+    POOL = None
+    POOL_LOCK = Lock()
+    # set to None to disable caching, or to a VerdictCache with a filename to persist verdicts
+    CACHE = VerdictCache()
+    STATS = {'checks' : 0, 'wait' : 0.0, 'parse' : 0.0}
+    STATS_LOCK = Lock()
+    # set to None to give every check the fixed budget below
+    SCHEDULE = BudgetSchedule()
+    PROVER_TIMEOUT = 60
+    BUILDER_MAX_MODELS = 500
+    # the exit codes of Prover9 which decide a check: a proof was found
+    # (max_proofs) or there is none (sos_empty); the others (fatal error,
+    # max_seconds, max_megs, ...) leave it undecided. Mace4 decides a check
+    # only by exiting with 0, when it has found a model.
+    PROVER_DECIDED = (0, 2)
 
-    def __init__(self, prover_goal, builder_goal, prover_timeout=60, builder_max_models=500):
+    def __init__(self, prover_goal, builder_goal, prover_timeout=None, builder_max_models=None, assumptions=None,
+                 schedule=None):
+        """
+        @param prover_timeout: a fixed max_seconds for the prover, instead of
+        the budgets of the schedule
+        @param builder_max_models: a fixed end_size for the builder
+        @param assumptions: C{list} of formulas already in Prover9 syntax,
+        see L{InferenceSession}
+        @param schedule: the L{BudgetSchedule}, Theorem.SCHEDULE if None
+        """
         self.prover_goal = prover_goal
         self.builder_goal = builder_goal
+        self.assumptions = assumptions or []
         self.prover_timeout = prover_timeout
         self.builder_max_models = builder_max_models
+        self.schedule = schedule
+        self._processes = []
+        self._terminated = False
+
+    @staticmethod
+    def default_pool():
+        """The pool used by checks that are not given one explicitly.
+        Assign Theorem.POOL to configure it."""
+        if Theorem.POOL is None:
+            Theorem.POOL_LOCK.acquire()
+            try:
+                if Theorem.POOL is None:
+                    Theorem.POOL = ProverPool()
+            finally:
+                Theorem.POOL_LOCK.release()
+        return Theorem.POOL
     
     def _find_binary(self, name, verbose=False):
         return find_binary(name,
@@ -101,80 +404,132 @@ class Theorem(object):
         return self._input(self.builder_goal)
     
     def _input(self, goal):
-        return "formulas(goals).\n    %s.\nend_of_list.\n\n" % convert_to_prover9(goal)
+        if goal is None:
+            # the prover looks for a contradiction, the builder for a model of the assumptions
+            goals = ""
+        else:
+            goals = "formulas(goals).\n    %s.\nend_of_list.\n\n" % convert_to_prover9(goal)
+        if not self.assumptions:
+            return goals
+        return "formulas(assumptions).\n%s\nend_of_list.\n\n%s" % \
+            ("\n".join(["    %s." % assumption for assumption in self.assumptions]), goals)
 
-    def check(self, run_builder=False, verbose=False):
-        prover_input = 'assign(max_seconds, %d).\n\n' % self.prover_timeout if self.prover_timeout > 0 else ""
-        prover_input += self._prover9_input()
+    @staticmethod
+    def statistics():
+        """@return: a C{dict} with the number of checks run, and the seconds
+        spent waiting for the prover/builder and parsing their output"""
+        Theorem.STATS_LOCK.acquire()
+        try:
+            return dict(Theorem.STATS)
+        finally:
+            Theorem.STATS_LOCK.release()
 
-        builder_input = 'assign(end_size, %d).\n\n' % self.builder_max_models if self.builder_max_models > 0 else ""
-        builder_input += self._mace_input()
+    @staticmethod
+    def reset_statistics():
+        Theorem.STATS_LOCK.acquire()
+        try:
+            Theorem.STATS.update(checks=0, wait=0.0, parse=0.0)
+        finally:
+            Theorem.STATS_LOCK.release()
 
-        return self._call(prover_input, builder_input, run_builder, verbose)
+    def _record(self, wait, parse):
+        Theorem.STATS_LOCK.acquire()
+        try:
+            Theorem.STATS['checks'] += 1
+            Theorem.STATS['wait'] += wait
+            Theorem.STATS['parse'] += parse
+        finally:
+            Theorem.STATS_LOCK.release()
 
-    def _model(self, valuation_str, verbose=False):
-        """
-        Transform the output file into an NLTK-style Valuation. 
-        
-        @return: A model if one is generated; None otherwise.
-        @rtype: L{nltk.sem.Valuation} 
-        """
-        valuation_standard_format = self._transform_output(valuation_str, 'standard', verbose)
-        
-        val = []
-        for line in valuation_standard_format.splitlines(False):
-            l = line.strip()
+    def check(self, run_builder=False, verbose=False, pool=None, model=False):
+        """Run the check on a worker of the given (or the default) L{ProverPool}.
+        @param model: build the Valuation of the model found by the builder;
+        otherwise only the verdict is returned, with None for the model
+        @return: (result, model)"""
+        return (pool or Theorem.default_pool()).check(self, run_builder, verbose, model)
 
-            if l.startswith('interpretation'):
-                # find the number of entities in the model
-                num_entities = int(l[l.index('(') + 1:l.index(',')].strip())
+    def terminate(self):
+        """Stop the prover and builder processes of a running check"""
+        self._terminated = True
+        for process in self._processes:
+            if process.poll() is None:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
 
-            elif l.startswith('function') and l.find('_') == -1:
-                # replace the integer identifier with a corresponding alphabetic character
-                name = l[l.index('(') + 1:l.index(',')].strip()
-                if is_indvar(name):
-                    name = name.upper()
-                value = int(l[l.index('[') + 1:l.index(']')].strip())
-                val.append((name, MaceCommand._make_model_var(value)))
-
-            elif l.startswith('relation'):
-                l = l[l.index('(') + 1:]
-                if '(' in l:
-                    #relation is not nullary
-                    name = l[:l.index('(')].strip()
-                    values = [int(v.strip()) for v in l[l.index('[') + 1:l.index(']')].split(',')]
-                    val.append((name, MaceCommand._make_relation_set(num_entities, values)))
-                else:
-                    #relation is nullary
-                    name = l[:l.index(',')].strip()
-                    value = int(l[l.index('[') + 1:l.index(']')].strip())
-                    val.append((name, value == 1))
+    def _budgets(self, goal, run_builder):
+        """@return: the schedule the check learns from (or None), the first
+        step, the total seconds of the check and the steps"""
+        schedule = self.schedule or Theorem.SCHEDULE
+        if schedule is None or self.prover_timeout is not None or self.builder_max_models is not None:
+            prover_timeout = Theorem.PROVER_TIMEOUT if self.prover_timeout is None else self.prover_timeout
+            end_size = Theorem.BUILDER_MAX_MODELS if self.builder_max_models is None else self.builder_max_models
+            return None, 0, prover_timeout, [(prover_timeout, end_size)]
+        return schedule, schedule.start(goal, run_builder), schedule.total, schedule.steps
 
-        return Valuation(val)
+    def _run(self, run_builder=False, verbose=False, timeout=None, model=False):
+        prover_goal = self._prover9_input()
+        builder_goal = self._mace_input() if run_builder else ""
 
-    def _transform_output(self, input_str, format, verbose=False):
+        # verdicts do not depend on the budget they were reached with
+        cache = Theorem.CACHE
+        if cache is not None:
+            key = VerdictCache.key(prover_goal + builder_goal)
+            verdict = cache.get(key)
+            # verdicts cached without a model do not do for a check asking for one,
+            # unless there is none to build
+            if verdict is not None and not (model and verdict[0] and verdict[1] is None):
+                if verbose:
+                    print 'Cached verdict:', verdict
+                return verdict
 
-        if Theorem.INTERPFORMAT_BINARY is None:
-            Theorem.INTERPFORMAT_BINARY = self._find_binary('interpformat', verbose)
+        schedule, first, total, steps = self._budgets(prover_goal, run_builder)
+        started = time.time()
+        verdict = Undecided((True, None))
+        for step in range(first, len(steps)):
+            elapsed = time.time() - started
+            remaining = timeout - elapsed if timeout else None
+            if remaining is not None and remaining <= 0:
+                break
+            prover_timeout, end_size = steps[step]
+            if total > 0:
+                # no step takes longer than what is left of the total
+                prover_timeout = max(min(prover_timeout, int(total - elapsed)), 1)
+            prover_input = 'assign(max_seconds, %d).\n\n' % prover_timeout if prover_timeout > 0 else ""
+            builder_input = ""
+            if run_builder:
+                builder_input = 'assign(end_size, %d).\n\n' % end_size if end_size > 0 else ""
+            verdict = self._call(prover_input + prover_goal, builder_input + builder_goal, run_builder, verbose,
+                                 remaining, model)
+            if self._terminated or not isinstance(verdict, Undecided):
+                break
+            if total > 0 and time.time() - started >= total - 1:
+                # no time left for a larger budget
+                break
+            if verbose and step + 1 < len(steps):
+                print "undecided with max_seconds %s and end_size %s, escalating..." % (prover_timeout, end_size)
 
-        if verbose:
-            print 'Calling Interpformat:', Theorem.INTERPFORMAT_BINARY
-            print 'Args:', format
-            print 'Input:\n', input_str, '\n'
-
-        p = subprocess.Popen([Theorem.INTERPFORMAT_BINARY, format], stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             stdin=subprocess.PIPE)
-        (stdout, stderr) = p.communicate(input_str)
+        # a check that timed out or was cancelled tells nothing about its budget
+        if self._terminated:
+            return verdict
+        if schedule is not None:
+            schedule.record(prover_goal, step, run_builder)
+        # undecided checks are not cached, the largest budget may decide them next time
+        if cache is not None:
+            cache.put(key, verdict)
+        return verdict
+
+    def _model(self, valuation_str, verbose=False):
+        """
+        Transform the output of the builder into an NLTK-style Valuation.
         
-        if verbose:
-            print 'Return code:', p.returncode
-            if stdout: print 'stdout:\n', stdout, '\n'
-            if stderr: print 'stderr:\n', stderr, '\n'
-            
-        return stdout
+        @return: A model if one is generated; None otherwise.
+        @rtype: L{nltk.sem.Valuation} 
+        """
+        return mace_valuation(valuation_str)
 
-    def _call(self, prover_input, builder_input, run_builder, verbose):
+    def _call(self, prover_input, builder_input, run_builder, verbose, timeout=None, model=False):
         if Theorem.PROVER_BINARY is None:
             Theorem.PROVER_BINARY = self._find_binary('prover9', verbose)
 
@@ -187,29 +542,56 @@ class Theorem(object):
             print 'Calling Builder:', Theorem.BUILDER_BINARY
             print 'Builder Input:\n', builder_input, '\n'
 
+        if self._terminated:
+            return Undecided((True, None))
+
+        # Both communicators set the same event when they are done, so waiting
+        # for whichever finishes first blocks without consuming any CPU
+        finished = Event()
+        started = time.time()
         prover_process = subprocess.Popen([Theorem.PROVER_BINARY], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-        prover_thread = Communicator(prover_process, prover_input)
+        self._processes.append(prover_process)
+        prover_thread = Communicator(prover_process, prover_input, finished)
         prover_thread.start()
         if run_builder:
             builder_process = subprocess.Popen([Theorem.BUILDER_BINARY], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-            builder_thread = Communicator(builder_process, builder_input)
+            self._processes.append(builder_process)
+            builder_thread = Communicator(builder_process, builder_input, finished)
             builder_thread.start()
 
-        while prover_thread.is_alive() and (not run_builder or builder_thread.is_alive()):
-            pass
+        finished.wait(timeout or None)
+        prover_done = prover_thread.done
+        builder_done = run_builder and builder_thread.done
+        waited = time.time() - started
 
-        stdout, stderr = prover_thread.result
-        returncode = prover_process.poll()
-        result = not (returncode == 0)
-        output = None
+        if not (prover_done or builder_done):
+            # Out of time: no proof has been found, just like when
+            # the prover itself runs out of max_seconds
+            if verbose:
+                print "check timed out after %s seconds, terminating..." % timeout
+            self.terminate()
+            self._record(waited, 0.0)
+            return Undecided((True, None))
 
-        if not prover_thread.is_alive():
+        if prover_done:
             if verbose:
-                print "Prover done, Builder %s " % ("done" if not builder_thread.is_alive() else "running")
+                print "Prover done, Builder %s " % ("done" if builder_done or not run_builder else "running")
             stdout, stderr = prover_thread.result
             returncode = prover_process.poll()
             result = not (returncode == 0)
             output = None
+            if model and run_builder and result:
+                # no proof of inconsistency, the model may still come
+                if not builder_done:
+                    if verbose:
+                        print "waiting for the builder..."
+                    builder_thread.join(max(timeout - waited, 0) if timeout else None)
+                if builder_thread.done and builder_process.poll() == 0:
+                    output = builder_thread.result[0]
+            decided = returncode in Theorem.PROVER_DECIDED
+            if model and run_builder and result and output is None and builder_thread.done:
+                # the model asked for may be in a larger domain
+                decided = False
             if run_builder and builder_process.poll() is None:
                 if verbose:
                     print "builder is still running, terminating..."
@@ -218,13 +600,15 @@ class Theorem(object):
                 except OSError:
                     pass
 
-        elif run_builder and not builder_thread.is_alive():
+        else:
             if verbose:
-                print "Prover %s, Builder done " % ("done" if not prover_thread.is_alive() else "running")
+                print "Prover running, Builder done "
             stdout, stderr = builder_thread.result
             returncode = builder_process.poll()
             result = (returncode == 0)
             output = stdout
+            # no model within the budget decides nothing
+            decided = result
             if prover_process.poll() is None:
                 if verbose:
                     print "prover is still running, terminating..."
@@ -238,62 +622,422 @@ class Theorem(object):
             if stderr: print('error:\t%s' % stderr)
             print 'return code:', returncode
 
-        # transform the model if one is available
+        # transform the model if one is available and asked for
+        started = time.time()
         if output is not None:
-            output = self._model(stdout, verbose)
+            output = self._model(output, verbose) if model else None
+        self._record(waited, time.time() - started)
 
+        if not decided:
+            return Undecided((result, output))
         return (result, output)
 
-def inference_check(expr, background_knowledge=False, verbose=False):
+MACE_MODEL = re.compile(r"interpretation\(\s*(\d+)\s*,.*?\]\)\.", re.S)
+# function(c1, [ 0 ]), relation(P(_,_), [ 0, 1, ... ]) or relation(R, [ 1 ]);
+# the tables of relations of more than one argument span several lines
+MACE_SYMBOL = re.compile(r"(function|relation)\(\s*([^\s(,]+)\s*(\([_,\s]*\))?\s*,\s*\[([\d,\s]*)\]\s*\)")
+
+def mace_valuation(output):
+    """
+    Build the Valuation of the first model in the raw output of Mace4,
+    as C{MaceCommand._make_relation_set()} does from the output of
+    C{interpformat standard}, without running interpformat.
+    
+    @return: A model if one is generated; None otherwise.
+    @rtype: L{nltk.sem.Valuation} 
+    """
+    model = MACE_MODEL.search(output)
+    if model is None:
+        return None
+    entities = [MaceCommand._make_model_var(value) for value in range(int(model.group(1)))]
+    # the argument tuples of all the cells of a relation table, by arity
+    tuples = {}
+    val = []
+    for kind, name, arguments, table in MACE_SYMBOL.findall(model.group(0)):
+        if kind == 'function':
+            # skolem functions are not part of the valuation
+            if not arguments:
+                if is_indvar(name):
+                    name = name.upper()
+                val.append((name, entities[int(table)]))
+        elif arguments:
+            arity = arguments.count('_')
+            try:
+                cells = tuples[arity]
+            except KeyError:
+                cells = tuples[arity] = list(product(entities, repeat=arity))
+            # the cells of a relation table are 0 or 1
+            values = "".join(table.split()).split(',')
+            val.append((name, set([cell for cell, value in zip(cells, values) if value == '1'])))
+        else:
+            val.append((name, table.strip() == '1'))
+    return Valuation(val)
+
+def remove_temporal_conds(e):
+    """Removes discourse structuring temporal conditions that could
+    affect inference check"""
+    for cond in list(e.conds):
+        if isinstance(cond, DrtEventualityApplicationExpression) and \
+        isinstance(cond.function, DrtEventualityApplicationExpression) and \
+        cond.function.function.variable.name in DrtTokens.TEMP_CONDS:
+            e.conds.remove(cond)
+            
+        elif isinstance(cond, DRS):
+            remove_temporal_conds(cond)
+            
+        elif isinstance(cond, DrtNegatedExpression) and \
+            isinstance(cond.term, DRS):
+            remove_temporal_conds(cond.term)
+            
+        elif isinstance(cond, DrtBooleanExpression) and \
+            isinstance(cond.first, DRS) and isinstance(cond.second, DRS): 
+            remove_temporal_conds(cond.first)
+            remove_temporal_conds(cond.second)           
+
+class InferenceSession(object):
+    """
+    The discourse admitted so far, kept as a set of Prover9 assumptions for
+    the checks of the next utterances. The referents of the discourse
+    become constants and each of its conditions one assumption, converted
+    to Prover9 syntax once, when the discourse is admitted. A check of an
+    expression that contains the whole admitted discourse (the referents
+    and the conditions of its main DRS) then only converts and sends the
+    rest, the new information, as its goal; the background knowledge is
+    sent as assumptions too. Any other expression is checked as a whole.
+    """
+    def __init__(self):
+        self.refs = []
+        self.conds = []
+        self._ref_set = set()
+        self._cond_set = set()
+        # Prover9 syntax of conditions and background knowledge
+        self._converted = {}
+        self._assumptions = []
+
+    def constant(self, ref):
+        """@return: the constant standing for a referent of the discourse;
+        Prover9 would take free variables starting with u-z for variables"""
+        return ConstantExpression(Variable("d_%s" % ref.name))
+
+    def _ground(self, formula):
+        """Replace the referents of the discourse in a formula by constants"""
+        for variable in formula.free() & self._ref_set:
+            formula = formula.replace(variable, self.constant(variable))
+        return formula
+
+    def _convert(self, key, formula):
+        try:
+            return self._converted[key]
+        except KeyError:
+            converted = self._converted[key] = convert_to_prover9(self._ground(formula))
+            return converted
+
+    def admit(self, reading):
+        """Make the (resolved) reading of the discourse, including its new
+        information, the discourse the next checks build on"""
+        expression = reading.deepcopy()
+        remove_temporal_conds(expression)
+        refs = list(expression.refs)
+        conds = []
+        # the new information becomes part of the main DRS, as it does
+        # when the discourse is concatenated with the new expression
+        pending = list(expression.conds)
+        while pending:
+            cond = pending.pop(0)
+            if isinstance(cond, DRS) and not isinstance(cond, PresuppositionDRS):
+                refs.extend(cond.refs)
+                pending[0:0] = cond.conds
+            else:
+                conds.append(cond)
+        self.refs = refs
+        self.conds = conds
+        self._ref_set = set(refs)
+        self._cond_set = set(conds)
+        # the conditions admitted before are not converted again
+        self._assumptions = [self._convert(cond, cond.fol()) for cond in conds]
+        # the type DRS.fol() states for each referent
+        for ref in refs:
+            ref_type = expression._ref_type(ref)
+            self._assumptions.append(self._convert(str(ref_type), ref_type.fol()))
+
+    def _aligned(self, expression):
+        """The discourse is resolved again with every new utterance, and a
+        proper name of the discourse may be bound to the same proper name
+        in the new utterance, which renames its referent.
+        @return: the expression with such referents renamed back, or None if
+        other referents of the discourse are missing"""
+        missing = [ref for ref in self.refs if ref not in set(expression.refs)]
+        if not missing:
+            return expression
+        if set(missing) & expression.all_variables():
+            return None
+        names = [cond for cond in expression.conds
+                 if isinstance(cond, DrtApplicationExpression) and cond.is_propername()]
+        mapping = {}
+        for ref in missing:
+            name = [cond.function for cond in self.conds if isinstance(cond, DrtApplicationExpression) and
+                    cond.is_propername() and cond.argument.variable == ref]
+            bearer = [cond.argument.variable for cond in names if name and cond.function == name[0]]
+            if not bearer or bearer[0] in self._ref_set:
+                return None
+            mapping[bearer[0]] = DrtVariableExpression(ref)
+        return expression.replace_many(mapping, True)
+
+    def theorem(self, expression, background_knowledge=None):
+        """@return: the L{Theorem} checking the expression against the
+        admitted discourse, i.e. whether the new information is consistent
+        with it, or None if the expression does not contain it"""
+        if not self.conds:
+            return None
+        expression = self._aligned(expression)
+        if expression is None:
+            return None
+        conds = set(expression.conds)
+        if not self._cond_set.issubset(conds):
+            return None
+        new = expression.__class__([ref for ref in expression.refs if ref not in self._ref_set],
+                                   [cond for cond in expression.conds if cond not in self._cond_set])
+        if not new.conds:
+            return None
+        assumptions = list(self._assumptions)
+        if background_knowledge:
+            assumptions.append(self._convert(str(background_knowledge), background_knowledge))
+        goal = self._ground(new.fol())
+        return Theorem(NegatedExpression(goal), goal, assumptions=assumptions)
+
+    def model(self, background_knowledge=None, verbose=False, pool=None):
+        """Build a model of the admitted discourse and the background knowledge.
+        Models are only built on demand, the checks just take the verdict.
+        @return: L{nltk.sem.Valuation}, or None if none was found"""
+        if not self.conds:
+            return None
+        assumptions = list(self._assumptions)
+        if background_knowledge:
+            assumptions.append(self._convert(str(background_knowledge), background_knowledge))
+        result, valuation = Theorem(None, None, assumptions=assumptions).check(True, verbose, pool, model=True)
+        return valuation
+
+class SyntacticCheck(object):
+    """
+    A consistency check decided on the conditions of a DRS alone, without
+    the prover. The atomic conditions of the main DRS and of the DRSs merged
+    into it (such as the new information) hold; a negated DRS whose
+    conditions then all hold, for some values of its referents, makes the
+    DRS inconsistent. A negated DRS without referents of which all
+    conditions but one hold makes that one false, and an implication
+    without referents in its antecedent adds its consequent once its
+    antecedent holds, until nothing changes. A DRS of atomic conditions
+    only, with no background knowledge, is consistent: all of its
+    conditions are true of a single individual. Everything else is left
+    to the prover.
+    """
+    STATS = {'checks' : 0, 'consistent' : 0, 'inconsistent' : 0}
+    STATS_LOCK = Lock()
+
+    def __init__(self, expression, background_knowledge=None):
+        self.background_knowledge = background_knowledge
+        self._free = set([str(variable) for variable in expression.free()])
+        self._refs = set()
+        # atoms are (predicate, argument names) pairs, indexed by predicate and arity
+        self._atoms = set()
+        self._index = {}
+        self._false = set()
+        self._negations = []
+        self._implications = []
+        # conditions the check does not look into
+        self._opaque = False
+        self._add(expression)
+
+    @staticmethod
+    def _atom(cond):
+        """@return: the atom of an atomic condition, or None"""
+        if isinstance(cond, EqualityExpression):
+            return ('=', (str(cond.first), str(cond.second)))
+        if isinstance(cond, ApplicationExpression):
+            function, args = cond.uncurry()
+            # anything else may not be atomic once simplified
+            if isinstance(function, AbstractVariableExpression):
+                return (str(function), tuple([str(arg) for arg in args]))
+        return None
+
+    def _assert(self, atom):
+        if atom not in self._atoms:
+            self._atoms.add(atom)
+            self._index.setdefault((atom[0], len(atom[1])), []).append(atom[1])
+
+    def _add(self, drs):
+        """Merge a DRS into the main one, if its referents do not clash
+        with the referents merged so far or with free variables"""
+        refs = set([str(ref) for ref in drs.refs])
+        if refs & (self._refs | self._free):
+            self._opaque = True
+            return
+        self._refs.update(refs)
+        for ref in drs.refs:
+            self._assert(self._atom(drs._ref_type(ref)))
+        for cond in drs.conds:
+            atom = self._atom(cond)
+            if atom is not None:
+                self._assert(atom)
+            elif isinstance(cond, DRS):
+                self._add(cond)
+            elif isinstance(cond, DrtNegatedExpression) and isinstance(cond.term, DRS):
+                self._negations.append(cond.term)
+            elif isinstance(cond, DrtNegatedExpression) and self._atom(cond.term) is not None:
+                self._false.add(self._atom(cond.term))
+            elif isinstance(cond, DrtImpExpression) and isinstance(cond.first, DRS) and \
+                isinstance(cond.second, DRS) and not cond.first.refs:
+                self._implications.append(cond)
+            else:
+                self._opaque = True
+
+    def _holds(self, drs):
+        """@return: whether the conditions of the DRS hold for some
+        values of its referents, by matching them with the atoms"""
+        patterns = [self._atom(drs._ref_type(ref)) for ref in drs.refs]
+        for cond in drs.conds:
+            atom = self._atom(cond)
+            if atom is None:
+                return False
+            patterns.append(atom)
+        variables = set([str(ref) for ref in drs.refs])
+        def match(i, binding):
+            if i == len(patterns):
+                return True
+            predicate, args = patterns[i]
+            for candidate in self._index.get((predicate, len(args)), ()):
+                extended = dict(binding)
+                for arg, value in zip(args, candidate):
+                    if arg in variables:
+                        if extended.setdefault(arg, value) != value:
+                            break
+                    elif arg != value:
+                        break
+                else:
+                    if match(i + 1, extended):
+                        return True
+            return False
+        return match(0, {})
+
+    def _propagate(self):
+        """@return: False if a contradiction follows from the conditions"""
+        changed = True
+        while changed:
+            changed = False
+            if self._false & self._atoms:
+                return False
+            for negation in self._negations:
+                if self._holds(negation):
+                    return False
+                if not negation.refs:
+                    atoms = [self._atom(cond) for cond in negation.conds]
+                    unknown = [atom for atom in atoms if atom not in self._atoms]
+                    if len(unknown) == 1 and None not in atoms and unknown[0] not in self._false:
+                        self._false.add(unknown[0])
+                        changed = True
+            for implication in list(self._implications):
+                if self._holds(implication.first):
+                    self._implications.remove(implication)
+                    self._add(implication.second)
+                    changed = True
+        return True
+
+    def verdict(self):
+        """@return: True if the DRS is consistent, False if it is not,
+        None if the prover has to decide"""
+        if not self._propagate():
+            verdict = False
+        elif not (self._negations or self._implications or self._false or self._opaque or self.background_knowledge):
+            verdict = True
+        else:
+            verdict = None
+        SyntacticCheck.STATS_LOCK.acquire()
+        try:
+            SyntacticCheck.STATS['checks'] += 1
+            if verdict is True:
+                SyntacticCheck.STATS['consistent'] += 1
+            elif verdict is False:
+                SyntacticCheck.STATS['inconsistent'] += 1
+        finally:
+            SyntacticCheck.STATS_LOCK.release()
+        return verdict
+
+    @staticmethod
+    def statistics():
+        """@return: a C{dict} with the number of checks, of those decided
+        consistent and inconsistent, and the fraction of checks decided"""
+        SyntacticCheck.STATS_LOCK.acquire()
+        try:
+            result = dict(SyntacticCheck.STATS)
+        finally:
+            SyntacticCheck.STATS_LOCK.release()
+        decided = result['consistent'] + result['inconsistent']
+        result['short_circuited'] = float(decided) / result['checks'] if result['checks'] else 0.0
+        return result
+
+    @staticmethod
+    def reset_statistics():
+        SyntacticCheck.STATS_LOCK.acquire()
+        try:
+            SyntacticCheck.STATS.update(checks=0, consistent=0, inconsistent=0)
+        finally:
+            SyntacticCheck.STATS_LOCK.release()
+
+def inference_check(expr, background_knowledge=False, verbose=False, pool=None, session=None, run_builder=False,
+                    schedule=None):
     """General function for all kinds of inference-based checks:
-    consistency, global and local informativity"""
+    consistency, global and local informativity. Checks are run
+    on the given L{ProverPool}, or on the default one, with the budgets
+    of the given L{BudgetSchedule}, or of the default one. If an
+    L{InferenceSession} is given, the discourse it holds is not
+    converted and sent as a whole again. With run_builder, Mace4 races
+    Prover9 on every check; the checks only need the verdict, so no
+    model is built either way (see L{InferenceSession.model})."""
     
     assert isinstance(expr, DRS), "Expression %s is not a DRS"
 
     expression = expr.deepcopy()
     if verbose:
         print "\n##### Inference check initiated #####\n\nExpression:\t%s\n" % expression
-    
-    def _remove_temporal_conds(e):
-        """Removes discourse structuring temporal conditions that could
-        affect inference check"""
-        for cond in list(e.conds):
-            if isinstance(cond, DrtEventualityApplicationExpression) and \
-            isinstance(cond.function, DrtEventualityApplicationExpression) and \
-            cond.function.function.variable.name in DrtTokens.TEMP_CONDS:
-                e.conds.remove(cond)
-                
-            elif isinstance(cond, DRS):
-                _remove_temporal_conds(cond)
-                
-            elif isinstance(cond, DrtNegatedExpression) and \
-                isinstance(cond.term, DRS):
-                _remove_temporal_conds(cond.term)
-                
-            elif isinstance(cond, DrtBooleanExpression) and \
-                isinstance(cond.first, DRS) and isinstance(cond.second, DRS): 
-                _remove_temporal_conds(cond.first)
-                _remove_temporal_conds(cond.second)           
 
-    def _check(expression):
-        """method performing check"""
-        if background_knowledge:
+    def _theorem(expression):
+        """the theorem to check for the expression"""
+        theorem = None
+        if session is not None:
+            theorem = session.theorem(expression, background_knowledge)
+            if theorem is not None and verbose:
+                print "performing check on the new information: %s" % theorem.builder_goal
+        if theorem is None and background_knowledge:
             e = AndExpression(expression.fol(), background_knowledge)
             if verbose:
                 print "performing check on: %s" % e
-            t = Theorem(NegatedExpression(e), e)
-        else:
+            theorem = Theorem(NegatedExpression(e), e)
+        elif theorem is None:
             if verbose:
                 print "performing check on: %s" % expression.fol()
-            t = Theorem(NegatedExpression(expression), expression)
-        
-        result, output = t.check()
+            theorem = Theorem(NegatedExpression(expression), expression)
+        theorem.schedule = schedule
+        return theorem
+
+    def _verdict(result, output):
+        """the checks are verdict-only, there is no model in the output"""
         if verbose:
-            if output:
-                print "\nMace4 returns:\n%s\n" % output
-            else:
-                print "\nProver9 returns: %s\n" % (not result)
-        return result      
+            print "\nProver9 returns: %s\n" % (not result)
+        return result
+
+    def _precheck(expression):
+        """the verdict of the L{SyntacticCheck}, None if it leaves it to the prover"""
+        verdict = SyntacticCheck(expression, background_knowledge).verdict()
+        if verbose and verdict is not None:
+            print "\nDecided without the prover: %s\n" % verdict
+        return verdict
+
+    def _check(expression):
+        """method performing check"""
+        verdict = _precheck(expression)
+        if verdict is not None:
+            return verdict
+        return _verdict(*_theorem(expression).check(run_builder, pool=pool, model=False))
     
     def consistency_check(expression):
         """1. Consistency check"""
@@ -353,8 +1097,8 @@ def inference_check(expr, background_knowledge=False, verbose=False):
                 temp = (expression.conds[:expression.conds.index(cond)] + 
                     expression.conds[expression.conds.index(cond) + 1:])
                 local_check.append((expression.__class__(expression.refs, temp), cond.first))
-                local_check.append((ConcatenationDRS(expression.__class__(expression.refs, temp),
-                                                         cond.first).simplify(), cond.second))
+                local_check.append((simplified(ConcatenationDRS(expression.__class__(expression.refs, temp),
+                                                                cond.first)), cond.second))
 
 
         if not local_check == []:
@@ -365,29 +1109,66 @@ def inference_check(expr, background_knowledge=False, verbose=False):
             return True
         
     def local_informativity_check(check_list):
-        """3. Local admissibility constraints"""
+        """3. Local admissibility constraints. All checks are independent, so they
+        run concurrently. The error reported is the one of the first failing
+        check in discourse order: once a check fails, the checks after it are
+        cancelled and only the ones before it are waited for"""
         if verbose: print "### Local admissibility check initiated...\n%s\n" % check_list
 
-        for main, sub in check_list:
-            assert isinstance(main, DRS), "Expression %s is not a DRS"
-            assert isinstance(sub, DRS), "Expression %s is not a DRS"
+        prover_pool = pool or Theorem.default_pool()
+        finished = Queue()
+        # the error messages of the checks, in discourse order, and the
+        # jobs of the checks the syntactic check left to the prover
+        messages = []
+        jobs = {}
+        failed = None
+        try:
+            for main, sub in check_list:
+                assert isinstance(main, DRS), "Expression %s is not a DRS"
+                assert isinstance(sub, DRS), "Expression %s is not a DRS"
 
-            if not _check(main.__class__(main.refs, main.conds + [DrtNegatedExpression(sub)])):
-                error_message = "New discourse is inadmissible due to local uninformativity:\n\n%s entails %s" % (main, sub)
-                if verbose:
-                    print "#!!!#: ", error_message
-                return AdmissibilityError(error_message)
-                
-            elif not _check(main.__class__(main.refs, main.conds + [sub])):
-                error_message = "New discourse is inadmissible due to local uninformativity:\n\n%s entails the negation of %s" % (main, sub)
-                if verbose:
-                    print "#!!!#: ", error_message
-                return AdmissibilityError(error_message)
-                
-        if verbose: print "##OK##: Main %s does not entail sub %s nor its negation\n" % (main, sub)
+                for e, error_message in ((main.__class__(main.refs, main.conds + [DrtNegatedExpression(sub)]),
+                    "New discourse is inadmissible due to local uninformativity:\n\n%s entails %s" % (main, sub)),
+                    (main.__class__(main.refs, main.conds + [sub]),
+                    "New discourse is inadmissible due to local uninformativity:\n\n%s entails the negation of %s" % (main, sub))):
+                    verdict = _precheck(e)
+                    if verdict is None:
+                        job = prover_pool.submit_theorem(_theorem(e), run_builder, model=False)
+                        job.add_done_callback(lambda job, index=len(messages): finished.put(index))
+                        jobs[len(messages)] = job
+                    messages.append(error_message)
+                    if verdict is False:
+                        # the checks after this one do not matter
+                        failed = len(messages) - 1
+                        break
+                if failed is not None:
+                    break
+
+            pending = set(jobs)
+            while pending:
+                index = finished.get()
+                if index not in pending:
+                    # cancelled
+                    continue
+                pending.remove(index)
+                if not _verdict(*jobs[index].result()):
+                    failed = index
+                    for later in [later for later in pending if later > index]:
+                        pending.remove(later)
+                        jobs[later].cancel()
+        finally:
+            for job in jobs.values():
+                job.cancel()
+
+        if failed is not None:
+            if verbose:
+                print "#!!!#: ", messages[failed]
+            return AdmissibilityError(messages[failed])
+
+        if verbose: print "##OK##: No main DRS entails its sub DRS nor its negation\n"
         return True                
 
-    _remove_temporal_conds(expression)
+    remove_temporal_conds(expression)
     if verbose: print "Expression without eventuality-relating conditions: %s \n" % expression
     
     cons_check = consistency_check(expression)
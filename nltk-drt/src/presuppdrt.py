@@ -8,11 +8,13 @@ __date__ = "Tue, 24 Aug 2010"
 
 import re
 import operator
+import weakref
+import threading
 
 from nltk.sem.logic import Variable
 from nltk.sem.logic import EqualityExpression, ApplicationExpression, ExistsExpression, AndExpression
 from nltk.sem.logic import IndividualVariableExpression
-from nltk.sem.logic import _counter, is_eventvar, is_funcvar
+from nltk.sem.logic import is_eventvar, is_funcvar
 from nltk.sem.logic import BasicType
 from nltk.sem.logic import Expression
 from nltk.sem.logic import ParseException
@@ -117,10 +119,158 @@ def unique_variable(pattern=None, ignore=None):
     else:
         prefix = 'z'
         
-    v = Variable(prefix + str(_counter.get()))
-    while ignore is not None and v in ignore:
-        v = Variable(prefix + str(_counter.get()))
-    return v
+    return variable_allocator().variable(prefix, ignore)
+
+class VariableAllocator(object):
+    """
+    Generates the unique variables of a session, e.g. of parsing a text or
+    of resolving an expression, with a counter for each prefix (z, e0, s0,
+    t0, F). The variables generated in a session depend only on what the
+    session does, not on other sessions or threads, so the same input
+    gives the same output. Outside a session, variables are drawn from
+    an allocator shared by the whole process, which never generates a
+    variable that any allocator has generated or reserved before.
+    """
+    GENERATED = re.compile(r'^(z|F|[est]0)(\d+)$')
+
+    def __init__(self, start=None):
+        """
+        @param start: a C{VariableAllocator} whose variables are still in
+        use (e.g. in a grammar), the counters start where its counters are
+        """
+        self._counters = {}
+        if start is not None:
+            self._counters.update(start._counters)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return self._counters
+
+    def __setstate__(self, counters):
+        self._counters = counters
+        self._lock = threading.Lock()
+        # the variables may have been generated in another process
+        for prefix, count in counters.items():
+            _process_allocator._count(prefix, count)
+
+    def variable(self, prefix, ignore=None):
+        """@return: a new C{Variable} with the given prefix, not in ignore"""
+        self._lock.acquire()
+        try:
+            count = self._counters.get(prefix, 0) + 1
+            v = Variable(prefix + str(count))
+            while ignore is not None and v in ignore:
+                count += 1
+                v = Variable(prefix + str(count))
+            self._counters[prefix] = count
+        finally:
+            self._lock.release()
+        if self is not _process_allocator:
+            _process_allocator._count(prefix, count)
+        return v
+
+    def _count(self, prefix, count):
+        """Make sure that the counter of prefix is at least count"""
+        self._lock.acquire()
+        try:
+            if count > self._counters.get(prefix, 0):
+                self._counters[prefix] = count
+        finally:
+            self._lock.release()
+
+    def state(self):
+        """@return: the counters, to go back to them with L{restore()}"""
+        self._lock.acquire()
+        try:
+            return dict(self._counters)
+        finally:
+            self._lock.release()
+
+    def restore(self, state):
+        """Generate the variables again from a L{state()}, when the ones
+        generated since are not used anywhere"""
+        self._lock.acquire()
+        try:
+            self._counters = dict(state)
+        finally:
+            self._lock.release()
+
+    def reserve(self, expression):
+        """Make sure that the variables generated from now on do not occur
+        in the given expression"""
+        for variable in expression.all_variables():
+            match = VariableAllocator.GENERATED.match(variable.name)
+            if match:
+                prefix, count = match.group(1), int(match.group(2))
+                self._count(prefix, count)
+                if self is not _process_allocator:
+                    _process_allocator._count(prefix, count)
+
+# the allocator of the threads outside any session
+_process_allocator = VariableAllocator()
+
+_allocators = threading.local()
+
+def variable_allocator():
+    """@return: the L{VariableAllocator} unique_variable() draws from in the
+    current thread: the one of the current session, or the one shared by
+    the whole process"""
+    allocator = getattr(_allocators, 'current', None)
+    if allocator is None:
+        return _process_allocator
+    return allocator
+
+def set_variable_allocator(allocator):
+    """Start a session in the current thread, unique_variable() draws from
+    the given L{VariableAllocator} until the previous one is set back.
+    @return: the previous allocator"""
+    previous = variable_allocator()
+    _allocators.current = allocator
+    return previous
+
+def in_session(allocator, function, *args):
+    """Call function with the given L{VariableAllocator} set for the call"""
+    previous = set_variable_allocator(allocator)
+    try:
+        return function(*args)
+    finally:
+        set_variable_allocator(previous)
+
+def simplified(expression):
+    """@return: expression.simplify(), in a session which does not generate
+    any of the variables of the expression, e.g. for a concatenation of
+    expressions parsed in sessions of their own"""
+    return in_session(expression._session(), expression.simplify)
+
+# Structurally identical variable and application expressions are shared,
+# they are kept here as long as they are in use anywhere
+_INTERNED = weakref.WeakValueDictionary()
+
+def _interned(cls, key):
+    """Return the expression of the given class interned under the key,
+    or a new (uninitialized) one, which is interned from now on"""
+    expr = _INTERNED.get(key)
+    if expr is None:
+        expr = _INTERNED.setdefault(key, object.__new__(cls))
+    return expr
+
+# The width and height of the drawn expressions, cached by the DrsDrawer,
+# by id(); an entry is dropped with its expression
+_DRAWING_SIZES = {}
+
+def _drawing_size(index):
+    """A property for one of the cached sizes of a drawn expression"""
+    def get(self):
+        size = _DRAWING_SIZES.get(id(self), (None, None, None))[index + 1]
+        if size is None:
+            raise AttributeError("The drawing size has not been cached")
+        return size
+    def set(self, size):
+        key = id(self)
+        if key not in _DRAWING_SIZES:
+            _DRAWING_SIZES[key] = [weakref.ref(self, lambda ref: _DRAWING_SIZES.pop(key, None)), None, None]
+        _DRAWING_SIZES[key][index + 1] = size
+    return property(get, set)
 
 class TimeVariableExpression(IndividualVariableExpression):
     """This class represents variables that take the form of a single lowercase
@@ -150,6 +300,72 @@ class ReverseIterator:
             i -= 1
             yield self.sequence[i]
 
+class Scope(dict):
+    """The variables bound above an expression, mapped to their binding
+    depth, i.e. the number of variables bound before them on the way from
+    the root. Used to build canonical forms, see L{AbstractDrs.canonical()}"""
+    depth = 0
+
+    def bind(self, variables):
+        """@return: a new scope, with the given variables bound below self"""
+        scope = Scope(self)
+        scope.depth = self.depth
+        for variable in variables:
+            scope[variable] = scope.depth
+            scope.depth += 1
+        return scope
+
+class Trail(list):
+    """
+    The expressions on the way from the root to the expression whose
+    readings are being looked for. A single trail is shared by the whole
+    traversal: every expression pushes itself before it visits its
+    children and pops itself afterwards. The outer DRS, the local DRS
+    and the position of each expression are kept up to date on the way,
+    so that they need not be searched for.
+    """
+    def __init__(self):
+        list.__init__(self)
+        # positions of the DRSs (not their subclasses)
+        self._drss = []
+        # positions of the DRSs that are not the term of a negation
+        self._local_drss = []
+        self._positions = {}
+
+    def push(self, expr):
+        position = len(self)
+        if expr.__class__ is DRS:
+            self._drss.append(position)
+            if not position or not isinstance(self[-1], DrtNegatedExpression):
+                self._local_drss.append(position)
+        self._positions.setdefault(id(expr), position)
+        self.append(expr)
+
+    def pop(self):
+        expr = list.pop(self)
+        position = len(self)
+        if self._drss and self._drss[-1] == position:
+            self._drss.pop()
+            if self._local_drss and self._local_drss[-1] == position:
+                self._local_drss.pop()
+        if self._positions.get(id(expr)) == position:
+            del self._positions[id(expr)]
+        return expr
+
+    def outer_drs(self):
+        """@return: the outermost DRS, or None"""
+        if self._drss:
+            return self[self._drss[0]]
+
+    def local_drs(self):
+        """@return: the innermost DRS which is not the term of a negation, or None"""
+        if self._local_drss:
+            return self[self._local_drss[-1]]
+
+    def position(self, expr):
+        """@return: the index of the expression in the trail, or None"""
+        return self._positions.get(id(expr))
+
 class Reading(list):
     """
     A single reading, consists of a list of operations
@@ -157,7 +373,11 @@ class Reading(list):
     where the function would be executed on the given DRS
     when the reading is generated
     """
-    pass
+    # the expressions from the root to the DRS the reading was found in
+    path = None
+    # the positions of the expressions on the way from the root to the
+    # expression the reading was found for, see AbstractDrs.readings()
+    cursor = None
 
 class Binding(Reading):
     pass
@@ -171,6 +391,36 @@ class IntermediateAccommodation(Reading):
 class GlobalAccommodation(Reading): 
     pass
 
+def operation_table(operations):
+    """
+    Index the operations of a reading by the DRS they are executed on.
+    @param operations: a list of tuples (DRS, function), e.g. a L{Reading},
+    or None
+    @return: a C{dict} mapping the id of each DRS to the list of its
+    functions, in the order of the operations
+    """
+    table = {}
+    for drs, function in operations or ():
+        table.setdefault(id(drs), []).append(function)
+    return table
+
+def unique_readings(readings):
+    """
+    Drop the readings which are alphabetic variants of an earlier one.
+    @param readings: a list of resolved expressions, or of tuples
+    (expression, error) as returned by L{AbstractDrs.resolve()}
+    @return: a list of the remaining readings, in their original order
+    """
+    seen = set()
+    result = []
+    for reading in readings:
+        expression = reading[0] if isinstance(reading, tuple) else reading
+        form = expression.canonical()
+        if form not in seen:
+            seen.add(form)
+            result.append(reading)
+    return result
+
 class VariableReplacer(object):
     """A generic variable replacer functor to be used in readings"""
     def __init__(self, var, new_var, remove_ref=True):
@@ -227,7 +477,27 @@ class DrtTokens(drt.DrtTokens):
 class AbstractDrs(drt.AbstractDrs):
     """
     A base abstract DRT Expression from which every DRT Expression inherits.
+
+    The NLTK base classes give every expression a C{__dict__}, but it is
+    only allocated when an attribute that has no slot is set. The classes
+    below keep all their attributes in C{__slots__}, so that expressions
+    never have one. Attributes kept for other purposes, such as the sizes
+    cached by the L{DrsDrawer}, must be kept in side tables.
     """
+    __slots__ = ()
+
+    _drawing_width = _drawing_size(0)
+    _drawing_height = _drawing_size(1)
+
+    def __getstate__(self):
+        """The values of the slots, for pickle protocols that know nothing
+        about them"""
+        return dict([(name, getattr(self, name)) for cls in self.__class__.__mro__
+                     for name in getattr(cls, '__slots__', ()) if hasattr(self, name)])
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def applyto(self, other):
         return DrtApplicationExpression(self, other)
@@ -252,6 +522,28 @@ class AbstractDrs(drt.AbstractDrs):
     
     def __deepcopy__(self, memo):
         return self.deepcopy()
+
+    def apply_operations(self, operations):
+        """Generate a reading like deepcopy(operations) does, but copy-on-write:
+        only the DRSs the operations are executed on and the expressions
+        on the path from the root to them are copied, all other conditions
+        are shared with this expression.
+        @param operations: a list of tuples (DRS, function), e.g. a L{Reading}
+        """
+        functions = operation_table(operations)
+        # Only the path (and the DRSs on it) need to be visited; without
+        # a path that contains all the DRSs, every expression is visited
+        dirty = None
+        path = getattr(operations, 'path', None)
+        if path:
+            dirty = set([id(expr) for expr in path])
+            if not all(key in dirty for key in functions):
+                dirty = None
+        return self._rewrite(functions, dirty)
+
+    def _rewrite(self, functions, dirty):
+        """@see: apply_operations(). Expressions without sub-DRSs are shared"""
+        return self
     
     def make_EqualityExpression(self, first, second):
         return DrtEqualityExpression(first, second)
@@ -259,20 +551,71 @@ class AbstractDrs(drt.AbstractDrs):
     def make_VariableExpression(self, variable):
         return DrtVariableExpression(variable)
 
-    def normalize(self):
-        """Rename auto-generated unique variables"""
+    def _structural_hash(self):
+        """@return: a hash consistent with __eq__, or None if this kind of
+        expression has none (DRSs are equal up to alphabetic variants)"""
+        return None
+
+    def __hash__(self):
+        """Expressions containing DRSs are equal to their alphabetic
+        variants, so they are hashed on their L{canonical()} form"""
+        return hash(self.canonical())
+
+    def canonical(self):
+        """
+        Return the canonical form of the expression: a hashable structure
+        in which the variables bound within the expression are replaced by
+        their binding depth (de Bruijn levels), and free variables by their
+        names. All alphabetic variants of an expression have the same
+        canonical form, so comparing or hashing it takes a single walk of
+        the expression instead of one replace() per bound variable.
+        """
+        return self._canonical(Scope())
+
+    def _canonical(self, scope):
+        """@param scope: the L{Scope} of the variables bound above self"""
+        return self
+
+    def equivalent(self, other):
+        """Equality modulo alphabetic variance, @see: L{canonical()}"""
+        return isinstance(other, AbstractDrs) and self.canonical() == other.canonical()
+
+    def replace_many(self, mapping, replace_bound=False):
+        """
+        Replace all instances of several variables in a single walk of the
+        expression. The substitution is simultaneous: the expressions in
+        the mapping are not themselves searched for the variables.
+        @param mapping: C{dict} from C{Variable}s to C{Expression}s
+        @param replace_bound: C{boolean} Should bound variables be replaced?
+        @see: Expression.replace()
+        """
+        if not mapping:
+            return self
+        def combinator(a, *additional):
+            if len(additional) == 0:
+                return self.__class__(a)
+            elif len(additional) == 1:
+                return self.__class__(a, additional[0])
+        
+        return self.visit(lambda e: e.replace_many(mapping, replace_bound),
+                          combinator, set())
+
+    def all_variables(self):
+        """@return: C{set} of all the C{Variable}s in self, bound or free"""
         def f(e):
             if isinstance(e, Variable):
-                if re.match(r'^z\d+$', e.name) or re.match(r'^[est]0\d+$', e.name):
-                    return set([e])
-                else:
-                    return set([])
+                return set([e])
             else: 
                 combinator = lambda * parts: reduce(operator.or_, parts)
                 return e.visit(f, combinator, set())
-        
-        result = self
-        for i, v in enumerate(sorted(list(f(self)))):
+        return f(self)
+
+    def normalize(self):
+        """Rename auto-generated unique variables"""
+        generated = [v for v in self.all_variables()
+                     if re.match(r'^z\d+$', v.name) or re.match(r'^[est]0\d+$', v.name)]
+        mapping = {}
+        for i, v in enumerate(sorted(generated)):
             if is_eventvar(v.name):
                 newVar = 'e0%s' % (i + 1)
             elif is_timevar(v.name):
@@ -281,9 +624,8 @@ class AbstractDrs(drt.AbstractDrs):
                 newVar = 's0%s' % (i + 1)
             else:
                 newVar = 'z%s' % (i + 1)
-            result = result.replace(v,
-                        self.make_VariableExpression(Variable(newVar)), True)
-        return result
+            mapping[v] = self.make_VariableExpression(Variable(newVar))
+        return self.replace_many(mapping, True)
     
     def substitute_bindings(self, bindings):
         expr = self
@@ -307,60 +649,189 @@ class AbstractDrs(drt.AbstractDrs):
                         IntermediateAccommodation:2,
                         LocalAccommodation:3}
 
-    def resolve(self, inference_check=None, verbose=False):
+    def resolve(self, inference_check=None, verbose=False, executor=None):
         """
         This method does the whole job of collecting multiple readings.
         We aim to get new readings from the old ones by resolving
         presuppositional DRSs one by one. Every time one presupposition
         is resolved, new readings are created and replace the old ones,
         until there are no presuppositions left to resolve.
+        
+        If an executor (any object whose submit(function, *args) returns
+        a future with result() and cancel(), e.g. a L{workers.WorkerPool})
+        is given, the complete readings among the readings being tried
+        are checked concurrently on it (see L{iter_readings}).
+
+        The new variables of the readings are generated in a session of
+        their own (see L{VariableAllocator}), so the readings of an
+        expression are always the same.
         """
+        allocator = self._session()
+        operations = in_session(allocator, self.readings)
+        if not operations:
+            return [self]
+
         readings = []
-        errors = []
-        if inference_check:
-            failed_readings = []
+        failed_readings = []
+        for reading, error in self._iter_readings(operations, inference_check, verbose, allocator, executor):
+            if error is None:
+                readings.append(reading)
+            else:
+                failed_readings.append((reading, error))
+        if not inference_check:
+            return readings, readings
+        return readings, failed_readings
+
+    def iter_readings(self, inference_check=None, verbose=False, limit=None, executor=None):
+        """
+        A generator counterpart of L{resolve}: yields (reading, error) pairs
+        one by one, in the same order and with the same early return as
+        L{resolve}, where error is None for admissible readings (all readings
+        are admissible without an inference check). Only the readings on the
+        current path are kept in memory.
+
+        If an executor is given, a complete reading is checked on it while
+        the readings tried after it are built, and the complete ones among
+        them checked too, up to the first one that is not complete. Checks
+        that turn out not to be needed are cancelled, and the variables
+        generated for their readings are generated again, so the readings
+        are the same as without an executor. The executor must not be the
+        pool the inference check itself runs its checks on: its workers
+        would wait for checks queued behind them.
         
-        def traverse(base_reading, operations):
-            for operation in sorted(operations, key=lambda o: AbstractDrs.RESOLUTION_ORDER[type(o)]):
-                new_reading = base_reading.deepcopy(operation)
-                if verbose:
-                    print("reading: %s" % new_reading)
-                try:
-                    new_operations = new_reading.readings()
-                except Exception as ex:
-                    errors.append(str(ex))
-                    continue
-                if not new_operations:
-                    if inference_check:
-                        success, error = inference_check(new_reading)
+        @param limit: stop after this many admissible readings, or None
+        @raise ResolutionException: no reading is admissible and the
+        resolution of some presupposition failed
+        """
+        allocator = self._session()
+        operations = in_session(allocator, self.readings)
+        if not operations:
+            yield self, None
+            return
+        admitted = 0
+        for reading, error in self._iter_readings(operations, inference_check, verbose, allocator, executor):
+            yield reading, error
+            if error is None:
+                admitted += 1
+                if limit is not None and admitted >= limit:
+                    return
+
+    def _session(self):
+        """@return: a L{VariableAllocator} for a session on this expression"""
+        allocator = VariableAllocator()
+        allocator.reserve(self)
+        return allocator
+
+    def _iter_readings(self, operations, inference_check, verbose, allocator, executor=None):
+        errors = []
+        # whether a reading has been admitted, to raise only if none was
+        admitted = [False]
+
+        def expand(base_reading, operation):
+            """@return: the reading the operation gives and its operations
+            (none if it is complete), or None if finding them failed"""
+            new_reading = in_session(allocator, base_reading.apply_operations, operation)
+            if verbose:
+                print("reading: %s" % new_reading)
+            try:
+                return new_reading, in_session(allocator, new_reading.readings, None, operation.cursor)
+            except Exception as ex:
+                errors.append(str(ex))
+                return None
+
+        def complete(expanded):
+            return expanded is not None and not expanded[1]
+
+        def traverse(base_reading, operations, found):
+            """Yields the readings below base_reading. Sets found[0] when a
+            reading is admitted and its siblings need not be tried"""
+            operations = sorted(operations, key=lambda o: AbstractDrs.RESOLUTION_ORDER[type(o)])
+            # the siblings built while a check was running: what expand()
+            # returned, the future of the check of a complete reading and
+            # the state to go back to if the sibling is not tried
+            ahead = []
+            try:
+                for index, operation in enumerate(operations):
+                    if ahead:
+                        expanded, future, state = ahead.pop(0)
+                    else:
+                        expanded, future = expand(base_reading, operation), None
+                    if expanded is None:
+                        continue
+                    new_reading, new_operations = expanded
+                    if not new_operations:
+                        if inference_check and executor is not None:
+                            if future is None:
+                                future = executor.submit(inference_check, new_reading)
+                            while index + len(ahead) + 1 < len(operations) and \
+                                (not ahead or complete(ahead[-1][0])):
+                                state = (allocator.state(), len(errors))
+                                sibling = expand(base_reading, operations[index + len(ahead) + 1])
+                                ahead.append((sibling, executor.submit(inference_check, sibling[0])
+                                              if complete(sibling) else None, state))
+                            success, error = future.result()
+                        elif inference_check:
+                            success, error = inference_check(new_reading)
+                        else:
+                            success, error = True, None
                         if success:
-                            readings.append(new_reading)
-                            return True
+                            if ahead:
+                                # the siblings are not tried
+                                allocator.restore(ahead[0][2][0])
+                                del errors[ahead[0][2][1]:]
+                            admitted[0] = True
+                            if inference_check:
+                                found[0] = True
+                                yield new_reading, None
+                                return
+                            yield new_reading, None
                         else:
-                            failed_readings.append((new_reading, error))
+                            yield new_reading, error
                     else:
-                        readings.append(new_reading)
-                else:
-                    if traverse(new_reading, new_operations[0]):
-                        if len(operations) == 1 or AbstractDrs.RESOLUTION_ORDER[type(operation)] != 0:
-                            return True
-            return False
-
-        operations = self.readings()
-        if operations:
-            traverse(self, operations[0])
-        else:
-            return [self]
-
-        if not readings and errors:
-            raise ResolutionException(". ".join(errors)) 
-        return readings, failed_readings if inference_check else readings
-
-    def readings(self, trail=[]):
+                        subtree_found = [False]
+                        for pair in traverse(new_reading, new_operations[0], subtree_found):
+                            yield pair
+                        if subtree_found[0]:
+                            if len(operations) == 1 or AbstractDrs.RESOLUTION_ORDER[type(operation)] != 0:
+                                found[0] = True
+                                return
+            finally:
+                for expanded, future, state in ahead:
+                    if future is not None:
+                        future.cancel()
+
+        for pair in traverse(self, operations[0], [False]):
+            yield pair
+
+        if not admitted[0] and errors:
+            raise ResolutionException(". ".join(errors))
+
+    def readings(self, trail=None, start=None):
+        """
+        Find the first expression (in depth-first order) that needs to
+        be resolved and return its readings, or None.
+        
+        @param trail: the L{Trail} of the expressions above this one
+        @param start: a L{Reading.cursor}, to resume the search at the
+        expression a reading of this expression was found for. Operations
+        never add expressions to be resolved before that position, so the
+        expressions before it need not be searched again.
+        """
         raise NotImplementedError()
 
+    def _child_readings(self, index, child, trail, start=None):
+        """The readings of the child expression at the given position,
+        with the position added to the cursor of each reading"""
+        _readings = child.readings(trail, start) if start else child.readings(trail)
+        if _readings:
+            for reading in _readings[0]:
+                reading.cursor = [index] + (reading.cursor or [])
+        return _readings
+
 class DRS(AbstractDrs, drt.DRS):
     """A Temporal Discourse Representation Structure."""
+
+    __slots__ = ('refs', 'conds')
     
     def fol(self):
         if not self.conds:
@@ -370,6 +841,20 @@ class DRS(AbstractDrs, drt.DRS):
             accum = ExistsExpression(ref, AndExpression(accum, self._ref_type(ref).fol()))
         return accum
 
+    def __eq__(self, other):
+        """Equality modulo alphabetic variance, @see: L{AbstractDrs.canonical()}"""
+        if isinstance(other, AbstractDrs):
+            return self.canonical() == other.canonical()
+        return drt.DRS.__eq__(self, other)
+
+    def __hash__(self):
+        return hash(self.canonical())
+
+    def _canonical(self, scope):
+        scope = scope.bind(self.refs)
+        return (DrtTokens.OPEN_BRACKET, tuple([scope[ref] for ref in self.refs]),
+                tuple([cond._canonical(scope) for cond in self.conds]))
+
     def _ref_type(self, referent):
         """Checks a referent type and returns corresponding predicate"""
         ref_cond = None
@@ -388,39 +873,33 @@ class DRS(AbstractDrs, drt.DRS):
     def replace(self, variable, expression, replace_bound=False):
         """Replace all instances of variable v with expression E in self,
         where v is free in self."""
-        if variable in self.get_refs():
-            #if a bound variable is the thing being replaced
-            if not replace_bound:
-                return self
-            else:
-                if variable in self.refs:
-                    i = self.refs.index(variable)
-                    refs = self.refs[:i] + [expression.variable] + self.refs[i + 1:]
-                else:
-                    refs = self.refs
-                return self.__class__(refs,
-                           [cond.replace(variable, expression, True) for cond in self.conds])
+        return self.replace_many({variable: expression}, replace_bound)
+
+    def replace_many(self, mapping, replace_bound=False):
+        """@see: AbstractDrs.replace_many()"""
+        bound = set(self.get_refs())
+        if not replace_bound:
+            #the variables bound by this DRS are not replaced
+            mapping = dict([(variable, expression) for variable, expression in mapping.iteritems()
+                            if variable not in bound])
+        if not mapping:
+            return self
+
+        # any bound variable that appears in an expression replacing
+        # a free variable must be alpha converted to avoid a conflict
+        free = reduce(operator.or_, [expression.free() for variable, expression
+                                     in mapping.iteritems() if variable not in bound], set())
+        renames = dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                        for ref in (bound & free) - set(mapping)])
+        if renames:
+            self = self.replace_many(renames, True)
+
+        if replace_bound:
+            refs = [mapping[ref].variable if ref in mapping else ref for ref in self.refs]
         else:
-            #variable not bound by this DRS
-            
-            # any bound variable that appears in the expression must
-            # be alpha converted to avoid a conflict
-            for ref in (set(self.get_refs()) & expression.free()):
-                newvar = unique_variable(ref) 
-                newvarex = DrtVariableExpression(newvar)
-                if ref in self.refs:
-                    i = self.refs.index(ref)
-                    refs = self.refs[:i] + [newvar] + self.refs[i + 1:]
-                else:
-                    refs = self.refs
-                self = self.__class__(refs,
-                           [cond.replace(ref, newvarex, True) 
-                            for cond in self.conds])
-                
-            #replace in the conditions
-            return self.__class__(self.refs,
-                       [cond.replace(variable, expression, replace_bound) 
-                        for cond in self.conds])
+            refs = self.refs
+        return self.__class__(refs,
+                   [cond.replace_many(mapping, replace_bound) for cond in self.conds])
             
     def free(self, indvar_only=True):
         """@see: Expression.free()"""
@@ -442,26 +921,51 @@ class DRS(AbstractDrs, drt.DRS):
         Optionally, it can take a list of lists of tuples (DRS, function) 
         as an argument and generate a reading by performing 
         a substitution in the DRS as specified by the function.
-        @param operations: a list of lists of tuples
+        The operations are indexed by their DRS once, by the outermost
+        DRS, and the resulting table is passed down to the conditions.
+        @param operations: a list of lists of tuples, or an L{operation_table}
         """
-        functions = [function for drs, function in operations if drs is self]
+        if not isinstance(operations, dict):
+            operations = operation_table(operations)
         newdrs = self.__class__(list(self.refs), [cond.deepcopy(operations) for cond in self.conds])
-        for function in functions:
+        for function in operations.get(id(self), ()):
+            newdrs = function(newdrs)
+        return newdrs
+
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        conds = [cond._rewrite(functions, dirty) for cond in self.conds]
+        own_functions = functions.get(id(self))
+        if own_functions is None and all(new is old for new, old in zip(conds, self.conds)):
+            return self
+        newdrs = self.__class__(list(self.refs), conds)
+        for function in own_functions or ():
             newdrs = function(newdrs)
         return newdrs
 
     def simplify(self):
         return self.__class__(self.refs, [cond.simplify() for cond in self.conds])
 
-    def readings(self, trail=[]):
+    def readings(self, trail=None, start=None):
         """get the readings for this DRS"""
-        for i, cond in enumerate(self.conds):
-            _readings = cond.readings(trail + [self])
-            if _readings:
-                if _readings[1]:
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            first = start[0] if start else 0
+            for i in range(first, len(self.conds)):
+                _readings = self._child_readings(i, self.conds[i], trail, start[1:] if start and i == first else None)
+                if _readings:
+                    if _readings[1]:
+                        for reading in _readings[0]:
+                            reading.append((self, ConditionRemover(i)))
+                    # the innermost DRS sees the readings first
                     for reading in _readings[0]:
-                        reading.append((self, ConditionRemover(i)))
-                return _readings[0], False
+                        if reading.path is None:
+                            reading.path = list(trail)
+                    return _readings[0], False
+        finally:
+            trail.pop()
 
     def str(self, syntax=DrtTokens.NLTK):
         if syntax == DrtTokens.PROVER9:
@@ -493,6 +997,31 @@ def DrtVariableExpression(variable):
     
 
 class DrtAbstractVariableExpression(AbstractDrs, drt.DrtAbstractVariableExpression):   
+    __slots__ = ('variable',)
+
+    def __new__(cls, *args):
+        """There is only one expression of each class for a variable"""
+        if not args:
+            # unpickling
+            return object.__new__(cls)
+        return _interned(cls, (cls, args[0]))
+
+    def __reduce__(self):
+        return (self.__class__, (self.variable,))
+
+    def __hash__(self):
+        return hash(self.variable)
+
+    def _structural_hash(self):
+        return hash(self.variable)
+
+    def _canonical(self, scope):
+        return scope.get(self.variable, self.variable.name)
+
+    def replace_many(self, mapping, replace_bound=False):
+        """@see: AbstractDrs.replace_many()"""
+        return mapping.get(self.variable, self)
+
     def readings(self, trail=[]):
         return None
     
@@ -529,15 +1058,28 @@ class DrtFeatureExpression(DrtConstantExpression):
 
 class DrtFeatureConstantExpression(DrtConstantExpression):
     """A constant expression with syntactic features attached"""
+    __slots__ = ('features',)
+
+    def __new__(cls, *args):
+        # features are not interned
+        return object.__new__(cls)
+
     def __init__(self, variable, features):
         DrtConstantExpression.__init__(self, variable)
         self.features = features
 
+    def __reduce__(self):
+        return (self.__class__, (self.variable, self.features))
+
     def replace(self, variable, expression, replace_bound=False):
         """@see: Expression.replace()"""
         assert isinstance(variable, Variable), "%s is not a Variable" % variable
         assert isinstance(expression, Expression), "%s is not an Expression" % expression
-        return self.__class__(DrtConstantExpression.replace(self, variable, expression, replace_bound).variable, [feature.replace(variable, expression, replace_bound) for feature in self.features])
+        return self.replace_many({variable: expression}, replace_bound)
+
+    def replace_many(self, mapping, replace_bound=False):
+        """@see: AbstractDrs.replace_many()"""
+        return self.__class__(DrtConstantExpression.replace_many(self, mapping, replace_bound).variable, [feature.replace_many(mapping, replace_bound) for feature in self.features])
 
     def visit(self, function, combinator, default):
         """@see: Expression.visit()"""
@@ -545,6 +1087,10 @@ class DrtFeatureConstantExpression(DrtConstantExpression):
                       [function(e) for e in self.features], default))
         return re
 
+    def _canonical(self, scope):
+        return (DrtConstantExpression._canonical(self, scope),
+                tuple([feature._canonical(scope) for feature in self.features]))
+
     def str(self, syntax=DrtTokens.NLTK):
         return str(self.variable) + "{" + ",".join([str(feature) for feature in self.features]) + "}"
     
@@ -559,13 +1105,34 @@ class DrtProperNameExpression(DrtConstantExpression):
     pass
 
 class DrtNegatedExpression(AbstractDrs, drt.DrtNegatedExpression):
-    def readings(self, trail=[]):
-        return self.term.readings(trail + [self])
+    __slots__ = ('term',)
+
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            return self._child_readings(0, self.term, trail, start and start[1:])
+        finally:
+            trail.pop()
 
     def deepcopy(self, operations=None):
         return self.__class__(self.term.deepcopy(operations))
 
+    def _canonical(self, scope):
+        return (DrtTokens.NOT[DrtTokens.NLTK], self.term._canonical(scope))
+
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        term = self.term._rewrite(functions, dirty)
+        return self if term is self.term else self.__class__(term)
+
 class DrtLambdaExpression(AbstractDrs, drt.DrtLambdaExpression):
+    __slots__ = ('variable', 'term')
+
+    def __eq__(self, other):
+        return self.equivalent(other)
+
     def alpha_convert(self, newvar):
         """Rename all occurrences of the variable introduced by this variable
         binder in the expression to @C{newvar}.
@@ -578,54 +1145,97 @@ class DrtLambdaExpression(AbstractDrs, drt.DrtLambdaExpression):
         """@see: Expression.replace()"""
         assert isinstance(variable, Variable), "%s is not a Variable" % variable
         assert isinstance(expression, Expression), "%s is not an Expression" % expression
-        #if the bound variable is the thing being replaced
-        if self.variable == variable:
+        return self.replace_many({variable: expression}, replace_bound)
+
+    def replace_many(self, mapping, replace_bound=False):
+        """@see: AbstractDrs.replace_many()"""
+        #if the bound variable is one of the things being replaced
+        if self.variable in mapping:
             if replace_bound: 
+                expression = mapping[self.variable]
                 assert isinstance(expression, DrtAbstractVariableExpression), \
                        "%s is not a AbstractVariableExpression" % expression
                 return self.__class__(expression.variable,
-                                      self.term.replace(variable, expression, True))
+                                      self.term.replace_many(mapping, True))
             else: 
-                return self
-        else:
-            # if the bound variable appears in the expression, then it must
-            # be alpha converted to avoid a conflict
+                mapping = dict(mapping)
+                del mapping[self.variable]
+        if not mapping:
+            return self
+
+        # if the bound variable appears in one of the expressions, then it
+        # must be alpha converted to avoid a conflict
+        for expression in mapping.itervalues():
             if self.variable in expression.free():
                 self = self.alpha_convert(unique_variable(pattern=self.variable))
-                
-            #replace in the term
-            return self.__class__(self.variable,
-                                  self.term.replace(variable, expression, replace_bound))
+                break
+            
+        #replace in the term
+        return self.__class__(self.variable,
+                              self.term.replace_many(mapping, replace_bound))
 
-    def readings(self, trail=[]):
-        return self.term.readings(trail + [self])
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            return self._child_readings(0, self.term, trail, start and start[1:])
+        finally:
+            trail.pop()
     
     def deepcopy(self, operations=[]):
         return self.__class__(self.variable, self.term.deepcopy(operations))
+
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        term = self.term._rewrite(functions, dirty)
+        return self if term is self.term else self.__class__(self.variable, term)
+
+    def _canonical(self, scope):
+        scope = scope.bind([self.variable])
+        return (DrtTokens.LAMBDA[DrtTokens.NLTK], scope[self.variable], self.term._canonical(scope))
     
     def get_refs(self, recursive=False):
         """@see: AbstractExpression.get_refs()"""
         return []
 
 class DrtBooleanExpression(AbstractDrs, drt.DrtBooleanExpression):
-    def readings(self, trail=[]):
-        first_readings = self.first.readings(trail + [self])
-        if first_readings:
-            return first_readings
-        else:
-            return self.second.readings(trail + [self])
+    __slots__ = ('first', 'second')
+
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            if not start or start[0] == 0:
+                first_readings = self._child_readings(0, self.first, trail, start and start[1:])
+                if first_readings:
+                    return first_readings
+                start = None
+            return self._child_readings(1, self.second, trail, start and start[1:])
+        finally:
+            trail.pop()
     
     def deepcopy(self, operations=[]):
         return self.__class__(self.first.deepcopy(operations), self.second.deepcopy(operations))
 
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        first = self.first._rewrite(functions, dirty)
+        second = self.second._rewrite(functions, dirty)
+        if first is self.first and second is self.second:
+            return self
+        return self.__class__(first, second)
+
+    def _canonical(self, scope):
+        return (self.getOp(), self.first._canonical(scope), self.second._canonical(scope))
+
     def simplify(self):
         """When dealing with DRSs, it is good to have unique names for
         the referents bound by each DRS."""
         if isinstance(self.first, DRS) and isinstance(self.second, DRS):
-            new_second = self.second
-            for ref in set(self.first.get_refs(True)) & set(self.second.get_refs(True)):
-                newref = DrtVariableExpression(unique_variable(ref))
-                new_second = self.second.replace(ref, newref, True)
+            new_second = self.second.replace_many(dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                for ref in set(self.first.get_refs(True)) & set(self.second.get_refs(True))]), True)
 
             return drt.DrtBooleanExpression.simplify(self.__class__(self.first, new_second))
         
@@ -636,70 +1246,103 @@ class DrtOrExpression(DrtBooleanExpression, drt.DrtOrExpression):
     pass
 
 class DrtImpExpression(DrtBooleanExpression, drt.DrtImpExpression):
-    def readings(self, trail=[]):
-        first_readings = self.first.readings(trail + [self])
-        if first_readings:
-            return first_readings
-        else:
-            return self.second.readings(trail + [self, self.first])
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            if not start or start[0] == 0:
+                first_readings = self._child_readings(0, self.first, trail, start and start[1:])
+                if first_readings:
+                    return first_readings
+                start = None
+            # the antecedent is accessible from the consequent
+            trail.push(self.first)
+            try:
+                return self._child_readings(1, self.second, trail, start and start[1:])
+            finally:
+                trail.pop()
+        finally:
+            trail.pop()
 
     def __eq__(self, other):
-        if (isinstance(self, other.__class__) or isinstance(other, self.__class__)):
-            if isinstance(self.first, DRS) and isinstance(self.second, DRS) and isinstance(other.first, DRS) and isinstance(other.second, DRS):
-                if len(self.first.conds) == len(other.first.conds) and len(self.second.conds) == len(other.second.conds):
-                    for (r1, r2) in zip(self.first.refs + self.second.refs, other.first.refs + other.second.refs):
-                        varex = self.make_VariableExpression(r1)
-                        other = other.replace(r2, varex, True)
-                    return self.first.conds == other.first.conds and self.second.conds == other.second.conds
-            else:        
-                return self.first == other.first and self.second == other.second
-        return False
+        return self.equivalent(other)
+
+    def _canonical(self, scope):
+        if isinstance(self.first, DRS):
+            # the referents of the antecedent are accessible from the consequent
+            scope = scope.bind(self.first.refs)
+        return DrtBooleanExpression._canonical(self, scope)
 
 class DrtIffExpression(DrtBooleanExpression, drt.DrtIffExpression):
     pass
 
 class DrtEqualityExpression(AbstractDrs, drt.DrtEqualityExpression):
+    __slots__ = ('first', 'second')
+
     def readings(self, trail=[]):
         return None
     
     def deepcopy(self, operations=[]):
         return self.__class__(self.first.deepcopy(operations), self.second.deepcopy(operations))
 
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        first = self.first._rewrite(functions, dirty)
+        second = self.second._rewrite(functions, dirty)
+        if first is self.first and second is self.second:
+            return self
+        return self.__class__(first, second)
+
+    def _canonical(self, scope):
+        return (self.getOp(), self.first._canonical(scope), self.second._canonical(scope))
+
 class ConcatenationDRS(DrtBooleanExpression, drt.ConcatenationDRS):
     """DRS of the form '(DRS + DRS)'"""
     def replace(self, variable, expression, replace_bound=False):
         """Replace all instances of variable v with expression E in self,
         where v is free in self."""
+        return self.replace_many({variable: expression}, replace_bound)
+
+    def replace_many(self, mapping, replace_bound=False):
+        """@see: AbstractDrs.replace_many()"""
         first = self.first
         second = self.second
 
-        # If variable is bound by both first and second 
-        if isinstance(first, DRS) and isinstance(second, DRS) and \
-           variable in (set(first.get_refs(True)) & set(second.get_refs(True))):
-            first = first.replace(variable, expression, True)
-            second = second.replace(variable, expression, True)
-            
-        # If variable is bound by first
-        elif isinstance(first, DRS) and variable in first.refs:
-            if replace_bound: 
-                first = first.replace(variable, expression, replace_bound)
-                second = second.replace(variable, expression, replace_bound)
-
-        # If variable is bound by second
-        elif isinstance(second, DRS) and variable in second.refs:
-            if replace_bound:
-                first = first.replace(variable, expression, replace_bound)
-                second = second.replace(variable, expression, replace_bound)
-
-        else:
-            # alpha convert every ref that is free in 'expression'
-            for ref in (set(self.get_refs(True)) & expression.free()): 
-                v = DrtVariableExpression(unique_variable(ref))
-                first = first.replace(ref, v, True)
-                second = second.replace(ref, v, True)
-
-            first = first.replace(variable, expression, replace_bound)
-            second = second.replace(variable, expression, replace_bound)
+        shared = set()
+        if isinstance(first, DRS) and isinstance(second, DRS):
+            shared = set(first.get_refs(True)) & set(second.get_refs(True))
+        bound = set()
+        for drs in (first, second):
+            if isinstance(drs, DRS):
+                bound.update(drs.refs)
+
+        # variables bound by both first and second are always replaced,
+        # variables bound by one of them only if replace_bound is set
+        always = {}
+        rest = {}
+        free = set()
+        for variable, expression in mapping.iteritems():
+            if variable in shared:
+                always[variable] = expression
+            elif variable in bound:
+                if replace_bound:
+                    rest[variable] = expression
+            else:
+                rest[variable] = expression
+                free.update(expression.free())
+
+        # alpha convert every ref that is free in an expression replacing
+        # a free variable
+        renames = dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                        for ref in (set(self.get_refs(True)) & free) - set(mapping)])
+        if replace_bound:
+            always.update(rest)
+            rest = {}
+        for submapping, bound_too in ((renames, True), (always, True), (rest, replace_bound)):
+            if submapping:
+                first = first.replace_many(submapping, bound_too)
+                second = second.replace_many(submapping, bound_too)
             
         return self.__class__(first, second)
 
@@ -708,11 +1351,10 @@ class ConcatenationDRS(DrtBooleanExpression, drt.ConcatenationDRS):
         second = self.second.simplify()
 
         if isinstance(first, DRS) and isinstance(second, DRS):
-            # For any ref that is in both 'first' and 'second'
-            for ref in (set(first.get_refs(True)) & set(second.get_refs(True))):
-                # alpha convert the ref in 'second' to prevent collision
-                newvar = DrtVariableExpression(unique_variable(ref))
-                second = second.replace(ref, newvar, True)
+            # For any ref that is in both 'first' and 'second',
+            # alpha convert the ref in 'second' to prevent collision
+            second = second.replace_many(dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                for ref in set(first.get_refs(True)) & set(second.get_refs(True))]), True)
             
             #DRS type is derived from the first member or from the second one
             drs_type = first.__class__ if isinstance(first, PresuppositionDRS) else second.__class__
@@ -720,7 +1362,110 @@ class ConcatenationDRS(DrtBooleanExpression, drt.ConcatenationDRS):
         else:
             return self.__class__(first, second)
 
+    def _canonical(self, scope):
+        # the referents of both DRSs are bound by the concatenation
+        return DrtBooleanExpression._canonical(self, scope.bind(self.get_refs()))
+
+class DiscourseBuilder(object):
+    """
+    Builds the DRS of a discourse one sentence at a time. Appending a DRS
+    gives the same result as (discourse + drs).simplify(), but in time
+    proportional to the appended DRS only: the discourse is already
+    simplified, and the set of its referents is kept for finding the
+    referents to alpha convert.
+    """
+    def __init__(self):
+        self._refs = []
+        self._conds = []
+        self._referents = set()
+        self._type = None
+        # the discourse, if it is not a DRS
+        self._expression = None
+
+    def append(self, drs):
+        """Add a simplified DRS to the end of the discourse"""
+        if self._expression is not None or (self._type is not None and not isinstance(drs, DRS)):
+            self._expression = (self.drs() + drs).simplify()
+        elif self._type is None:
+            if isinstance(drs, DRS):
+                drs = drs.simplify()
+                self._refs.extend(drs.refs)
+                self._conds.extend(drs.conds)
+                self._referents.update(drs.get_refs(True))
+                self._type = drs.__class__
+            else:
+                self._expression = drs
+        else:
+            refs = drs.get_refs(True)
+            # alpha convert the referents of drs which are in the discourse
+            clashes = self._referents.intersection(refs)
+            if clashes:
+                drs = drs.replace_many(dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                                             for ref in clashes]), True)
+                refs = drs.get_refs(True)
+            self._refs.extend(drs.refs)
+            self._conds.extend(drs.conds)
+            self._referents.update(refs)
+            #DRS type is derived from the first member or from the last one
+            if not issubclass(self._type, PresuppositionDRS):
+                self._type = drs.__class__
+
+    def drs(self):
+        """@return: the DRS of the discourse, or None if it is empty"""
+        if self._expression is not None:
+            return self._expression
+        if self._type is None:
+            return None
+        return self._type(list(self._refs), list(self._conds))
+
 class DrtApplicationExpression(AbstractDrs, drt.DrtApplicationExpression):
+    # _hash is the structural hash, computed on demand
+    __slots__ = ('function', 'argument', '_hash')
+
+    def __new__(cls, *args):
+        """There is only one expression of each class applying a function
+        to an argument, so that conditions built from the same (interned)
+        predicates and referents are the same object"""
+        if len(args) != 2:
+            # unpickling
+            return object.__new__(cls)
+        return _interned(cls, (cls, id(args[0]), id(args[1])))
+
+    def __reduce__(self):
+        return (self.__class__, (self.function, self.argument))
+
+    def _canonical(self, scope):
+        return (self.function._canonical(scope), self.argument._canonical(scope))
+
+    def _structural_hash(self):
+        try:
+            return self._hash
+        except AttributeError:
+            function_hash = self.function._structural_hash()
+            argument_hash = self.argument._structural_hash()
+            if function_hash is None or argument_hash is None:
+                self._hash = None
+            else:
+                self._hash = hash((function_hash, argument_hash))
+            return self._hash
+
+    def __hash__(self):
+        structural_hash = self._structural_hash()
+        if structural_hash is None:
+            return AbstractDrs.__hash__(self)
+        return structural_hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, DrtApplicationExpression):
+            # conditions with different hashes differ, no need to compare them
+            structural_hash = self._structural_hash()
+            if structural_hash is not None:
+                other_hash = other._structural_hash()
+                if other_hash is not None and other_hash != structural_hash:
+                    return False
+        return drt.DrtApplicationExpression.__eq__(self, other)
     
     def fol(self):
         if self.is_propername():
@@ -741,24 +1486,41 @@ class DrtApplicationExpression(AbstractDrs, drt.DrtApplicationExpression):
         return isinstance(self.function, DrtConstantExpression) and\
         self.function.variable.name.istitle()
 
-    def readings(self, trail=[]):
-        function_readings = self.function.readings(trail + [self])
-        if function_readings:
-            return function_readings
-        else:
-            return self.argument.readings(trail + [self])
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        trail.push(self)
+        try:
+            if not start or start[0] == 0:
+                function_readings = self._child_readings(0, self.function, trail, start and start[1:])
+                if function_readings:
+                    return function_readings
+                start = None
+            return self._child_readings(1, self.argument, trail, start and start[1:])
+        finally:
+            trail.pop()
 
     def deepcopy(self, operations=[]):
         return self.__class__(self.function.deepcopy(operations), self.argument.deepcopy(operations))
 
+    def _rewrite(self, functions, dirty):
+        if dirty is not None and id(self) not in dirty:
+            return self
+        function = self.function._rewrite(functions, dirty)
+        argument = self.argument._rewrite(functions, dirty)
+        if function is self.function and argument is self.argument:
+            return self
+        return self.__class__(function, argument)
+
 class DrtEventualityApplicationExpression(DrtApplicationExpression):
     """application expression with state or event argument"""
     pass
 
 class PresuppositionDRS(DRS):
+    __slots__ = ('variable', 'features', 'function_name', 'cond')
         
-    def readings(self, trail=[]):
-        inner_readings = DRS.readings(self, trail)
+    def readings(self, trail=None, start=None):
+        trail = trail or Trail()
+        inner_readings = DRS.readings(self, trail, start)
         if inner_readings:
             return inner_readings
         else:
@@ -766,20 +1528,10 @@ class PresuppositionDRS(DRS):
             return self._presupposition_readings(trail)
         
     def _find_outer_drs(self, trail):
-        for expr in trail:
-            if expr.__class__ is DRS:
-                return expr
+        return trail.outer_drs()
         
     def _find_local_drs(self, trail):
-        drs = None
-        for expr in ReverseIterator(trail):
-            if drs:
-                if not isinstance(expr, DrtNegatedExpression):
-                    return drs
-                else: drs = None
-            if expr.__class__ is DRS:
-                drs = expr
-        return drs
+        return trail.local_drs()
     
     def is_possible_binding(self, cond):
         return is_unary_predicate(cond) and self.has_same_features(cond) and cond.argument.__class__ is DrtIndividualVariableExpression
@@ -853,23 +1605,16 @@ class PresuppositionDRS(DRS):
         return (not isinstance(cond.function, DrtFeatureConstantExpression) and not self.features) \
                 or (isinstance(cond.function, DrtFeatureConstantExpression) and cond.function.features == self.features)
 
-    def _get_condition_index(self, superordinate_drs, trail, condition_index_cache={}):
-        # Keep a condition index cache
-        if not condition_index_cache:
-            condition_index_cache = {}
-        superordinate_drs_index = id(superordinate_drs)
-        if superordinate_drs_index in condition_index_cache:
-            return condition_index_cache[superordinate_drs_index]
-        # Use a for loop and 'is' to find the condition. 
-        # Do not use index(), because it calls a time-consuming equals method.
-        for ind, trailee in enumerate(trail):
-            if trailee is superordinate_drs:
-                # The condition might be not in superordinate_drs, but inside one of its conditions (however deep we might need to go)
-                look_for = trail[ind + 1] if ind < len(trail) - 1 else self
-                for i, cond in enumerate(superordinate_drs.conds):
-                    if cond is look_for:
-                        condition_index_cache[superordinate_drs_index] = i
-                        return i # condition_index
+    def _get_condition_index(self, superordinate_drs, trail):
+        # The trail knows the position of the DRS, do not use index(),
+        # because it calls a time-consuming equals method.
+        ind = trail.position(superordinate_drs)
+        if ind is not None:
+            # The condition might be not in superordinate_drs, but inside one of its conditions (however deep we might need to go)
+            look_for = trail[ind + 1] if ind < len(trail) - 1 else self
+            for i, cond in enumerate(superordinate_drs.conds):
+                if cond is look_for:
+                    return i # condition_index
         return None
     
     class Operation(object):
@@ -250,8 +250,13 @@ class PresuppositionDRS(drt.PresuppositionDRS):
             individuals.setdefault(cond.argument.variable, []).append(cond)
 
 class DefiniteDescriptionDRS(drt.DefiniteDescriptionDRS):
+    __slots__ = ('_free_and_temporal',)
 
     def _get_free(self):
+        # The temporal conditions are taken out of self.conds on the first call.
+        # This DRS may be shared between readings, so the result is kept.
+        if getattr(self, '_free_and_temporal', None) is not None:
+            return self._free_and_temporal
         free = self.free(True)
         temporal_conditions = []
         # If there are free variables that stem from conditions like 'overlap', earlier', 'include',
@@ -273,7 +278,8 @@ class DefiniteDescriptionDRS(drt.DefiniteDescriptionDRS):
                         free.remove(expression_variable)
                 temporal_conditions.append(cond)
                 self.conds.remove(cond)
-        return free, temporal_conditions
+        self._free_and_temporal = (free, temporal_conditions)
+        return self._free_and_temporal
 
 class DrtParser(drt.DrtParser):
     """DrtParser producing conditions and referents for temporal logic"""
@@ -5,8 +5,13 @@ __author__ = "Alex Kislev, Emma Li, Peter Makarov"
 __version__ = "1.0"
 __date__ = "Tue, 24 Aug 2010"
 
+import os
+import shutil
+import tempfile
 from util import Tester
 from wntemporaldrt import DrtParser
+from inference import Theorem, VerdictCache
+from nltk.sem.logic import LogicParser
 
 #background knowledge
 BK = {
@@ -238,6 +243,79 @@ def test_inference(tester):
 
     tester.inference_test(cases_inf, BK, verbose=False)
 
+def test_variables(tester):
+    # the concatenation of expressions parsed separately must not bind
+    # a referent twice
+    cases = [
+    (1, "Mary kissed John", "Mary kissed John"),
+    
+    (2, "Jones owns a porsche", "He likes it"),
+    ]
+    
+    tester.concatenation_test(cases)
+
+def test_alphabetic_variants(tester):
+    # expressions equal up to the names of their referents are the same
+    # element of a set
+    cases = [
+    (1, r"-([x],[walk(x)])", r"-([y],[walk(y)])"),
+    
+    (2, r"(([x],[man(x)]) -> ([e],[walk(e), AGENT(e,x)]))", r"(([y],[man(y)]) -> ([e01],[walk(e01), AGENT(e01,y)]))"),
+    
+    (3, r"(([x],[dog(x)]) | ([y],[cat(y)]))", r"(([z],[dog(z)]) | ([w],[cat(w)]))"),
+    
+    (4, r"\P.([x],[P(x)])", r"\Q.([y],[Q(y)])"),
+    
+    (5, r"(([x],[dog(x)]) + ([y],[cat(y)]))", r"(([z],[dog(z)]) + ([w],[cat(w)]))"),
+    ]
+    
+    parser = DrtParser()
+    for number, expression, variant in cases:
+        expressions = set([parser.parse(expression), parser.parse(variant)])
+        if len(expressions) == 1:
+            print("%s. %s -- Alphabetic variant: %s\n" % (number, expression, variant))
+        else:
+            print("%s. !!!variants differ!!!\n\n%s\n\nand\t%s\n" % (number, expression, variant))
+
+# a prover which runs out of max_seconds the first time it is called
+# and finds the proof the next time
+STUB_PROVER = """#!/bin/sh
+cat > /dev/null
+if [ -f "$0.proved" ]; then
+    echo "THEOREM PROVED"
+    exit 0
+fi
+touch "$0.proved"
+echo "SEARCH FAILED"
+exit 4
+"""
+
+def test_verdict_cache(tester):
+    # an undecided check is not cached: the next check of the
+    # same goal runs the prover again and gets the proof
+    directory = tempfile.mkdtemp()
+    binaries, cache = (Theorem.PROVER_BINARY, Theorem.BUILDER_BINARY), Theorem.CACHE
+    try:
+        # the builder is not run
+        Theorem.PROVER_BINARY = Theorem.BUILDER_BINARY = os.path.join(directory, "prover9")
+        stub = open(Theorem.PROVER_BINARY, "w")
+        stub.write(STUB_PROVER)
+        stub.close()
+        os.chmod(Theorem.PROVER_BINARY, 0755)
+        Theorem.CACHE = VerdictCache()
+        goal = LogicParser().parse("man(socrates)")
+        expected = [(1, True, 0), (2, False, 1), (3, False, 1)]
+        for number, result, cached in expected:
+            returned = Theorem(goal, goal, prover_timeout=1).check()[0]
+            if returned == result and len(Theorem.CACHE) == cached:
+                print("%s. prover returns %s, %s cached verdict(s)\n" % (number, returned, cached))
+            else:
+                print("%s. !!!unexpected verdict!!!\n\nExpected:\t%s, %s cached\n\nReturns:\t%s, %s cached\n" %
+                      (number, result, cached, returned, len(Theorem.CACHE)))
+    finally:
+        (Theorem.PROVER_BINARY, Theorem.BUILDER_BINARY), Theorem.CACHE = binaries, cache
+        shutil.rmtree(directory)
+
 HASH_LINE = "#"*80
 
 def print_header(header):
@@ -247,7 +325,10 @@ def print_header(header):
 TESTS = [("Anaphora Component", test_anaphora),
          ("Presupposition Component", test_presupposition),
          ("Inference Component ", test_inference),
-         ("Tempotal Component", test_tenses)
+         ("Tempotal Component", test_tenses),
+         ("Unique Variables", test_variables),
+         ("Verdict Cache", test_verdict_cache),
+         ("Alphabetic Variants", test_alphabetic_variants)
          ]
 def main():
     tester = Tester('file:../data/grammar.fcfg', DrtParser)
@@ -5,17 +5,71 @@ __author__ = "Alex Kislev, Emma Li, Peter Makarov"
 __version__ = "1.0"
 __date__ = "Tue, 24 Aug 2010"
 
+import os
 import re
-from nltk import load_parser
+import sys
+import time
+import cPickle as pickle
+from hashlib import sha1
+from threading import Lock
+from nltk import data
+from nltk.tree import Tree
+from nltk.featstruct import unify, TYPE
+from nltk.parse import FeatureChartParser
+from nltk.parse.featurechart import FeatureChart, FeatureTreeEdge
 from temporaldrt import DrtVariableExpression, unique_variable, NewInfoDRS
-from presuppdrt import ResolutionException, DrtParser as PresuppDrtParser
+from presuppdrt import ResolutionException, DiscourseBuilder, VariableAllocator, in_session, simplified, DrtParser as PresuppDrtParser
 from types import LambdaType
 from nltk.sem.logic import AndExpression, ParseException, LogicParser
-from inference import inference_check, get_bk, AdmissibilityError, ConsistencyError, InformativityError
+from inference import Theorem, inference_check, get_bk, AdmissibilityError, ConsistencyError, InformativityError
 
 class UngrammaticalException(Exception):
     pass
 
+class FirstParseChartParser(FeatureChartParser):
+    """
+    A C{FeatureChartParser} which, when asked for the first n parses, stops
+    filling the chart as soon as it holds n complete parses, instead of
+    building the chart of all the parses and then the trees of all of them.
+    This saves time on ambiguous sentences only, see
+    L{benchmark.bench_first_parse}.
+    """
+    def nbest_parse(self, tokens, n=None, tree_class=Tree):
+        if n is None or not self._use_agenda:
+            return FeatureChartParser.nbest_parse(self, tokens, n, tree_class)
+        chart = self._chart_parse_until(tokens, n)
+        return chart.parses(self._grammar.start(), tree_class=tree_class)[:n]
+
+    def _chart_parse_until(self, tokens, n):
+        """The agenda-based algorithm of C{ChartParser.chart_parse()}, which
+        stops when n complete edges spanning the tokens are in the chart"""
+        tokens = list(tokens)
+        self._grammar.check_coverage(tokens)
+        chart = self._chart_class(tokens)
+        grammar = self._grammar
+        start = grammar.start()
+        parses = set()
+
+        def is_parse(edge):
+            return edge.is_complete() and edge.start() == 0 and edge.end() == chart.num_leaves() and \
+                isinstance(edge, FeatureTreeEdge) and edge.lhs()[TYPE] == start[TYPE] and \
+                unify(edge.lhs(), start, rename_vars=True)
+
+        for axiom in self._axioms:
+            axiom.apply(chart, grammar)
+        agenda = chart.edges()
+        agenda.reverse()
+        while agenda:
+            edge = agenda.pop()
+            for rule in self._inference_rules:
+                for new_edge in rule.apply_iter(chart, grammar, edge):
+                    agenda.append(new_edge)
+                    if is_parse(new_edge):
+                        parses.add(new_edge)
+                        if len(parses) >= n:
+                            return chart
+        return chart
+
 class Tester(object):
     
     INFERROR = {
@@ -38,14 +92,119 @@ class Tester(object):
      (re.compile("^bought$"), ("did", "buy")),
      (re.compile("^wrote$"), ("did", "write")),
     ]
+
+    # the loaded grammars, see load_grammar()
+    GRAMMARS = {}
+    GRAMMARS_LOCK = Lock()
     
-    def __init__(self, grammar, drt_parser):
+    def __init__(self, grammar, drt_parser, parses=1):
+        """
+        @param parses: the number of parses of a sentence to look for, the
+        DRS is taken from the first one. None to build all of them
+        """
         assert isinstance(grammar, str) and grammar.endswith('.fcfg'), \
                             "%s is not a grammar name" % grammar
         self.drt_parser = drt_parser()
         self.presupp_parser = PresuppDrtParser()
         self.logic_parser = LogicParser()
-        self.parser = load_parser(grammar, logic_parser=self.drt_parser) 
+        # the variables generated while loading the grammar occur in its
+        # semantics, parsing sessions start after them
+        feature_grammar, self.allocator = Tester.load_grammar(grammar, drt_parser)
+        # charts are built per parse, but the parser keeps a cache of the
+        # rules applied to the current chart, so each Tester has its own
+        self.parser = FirstParseChartParser(feature_grammar, chart_class=FeatureChart)
+        self.parses = parses
+
+    @staticmethod
+    def load_grammar(grammar, drt_parser):
+        """Load a grammar, with the semantics parsed by the given DrtParser
+        class, once per process. The grammar is shared by all Testers and
+        must not be changed. The compiled grammar is kept in a file next to
+        the grammar file, to be loaded quickly by the next process.
+        @return: the C{FeatureGrammar} and the L{VariableAllocator} that
+        generated the variables in its semantics"""
+        key = (grammar, drt_parser)
+        loaded = Tester.GRAMMARS.get(key)
+        if loaded is None:
+            Tester.GRAMMARS_LOCK.acquire()
+            try:
+                loaded = Tester.GRAMMARS.get(key)
+                if loaded is None:
+                    loaded = Tester.GRAMMARS[key] = Tester._compiled_grammar(grammar, drt_parser)
+            finally:
+                Tester.GRAMMARS_LOCK.release()
+        return loaded
+
+    @staticmethod
+    def _compiled_grammar(grammar, drt_parser):
+        """Load a grammar from the file of the compiled grammar next to it,
+        if it was compiled from the same grammar with the same DrtParser
+        class, or else from the grammar itself, and (re)write the file.
+        The file holds the expressions of the semantics, so the modules
+        defining the parser are part of what must be the same.
+        @return: the C{FeatureGrammar} and its L{VariableAllocator}"""
+        path = grammar[len('file:'):] if grammar.startswith('file:') else grammar
+        try:
+            source = open(path, 'rb').read()
+        except IOError:
+            # e.g. a grammar of the NLTK data package, there is nothing to compare
+            source = None
+        if source is not None:
+            digest = sha1(source)
+            for module in sorted(set([cls.__module__ for cls in drt_parser.__mro__])):
+                module_file = re.sub(r'\.py[co]$', '.py', getattr(sys.modules[module], '__file__', ''))
+                if os.path.isfile(module_file):
+                    digest.update(open(module_file, 'rb').read())
+            key = (digest.hexdigest(), drt_parser.__module__, drt_parser.__name__)
+            compiled_path = "%s.%s.pickle" % (path, drt_parser.__module__)
+            try:
+                compiled = open(compiled_path, 'rb')
+                try:
+                    if pickle.load(compiled) == key:
+                        return pickle.load(compiled)
+                finally:
+                    compiled.close()
+            except Exception:
+                # missing, stale or unreadable
+                pass
+
+        allocator = VariableAllocator()
+        # NLTK's own cache would hand out a grammar parsed by another DrtParser
+        feature_grammar = in_session(allocator, lambda: data.load(grammar, cache=False, logic_parser=drt_parser()))
+
+        if source is not None:
+            try:
+                # written under another name first, so that no other process
+                # ever reads half a file
+                temporary_path = "%s.%s" % (compiled_path, os.getpid())
+                compiled = open(temporary_path, 'wb')
+                try:
+                    pickle.dump(key, compiled, pickle.HIGHEST_PROTOCOL)
+                    pickle.dump((feature_grammar, allocator), compiled, pickle.HIGHEST_PROTOCOL)
+                finally:
+                    compiled.close()
+                os.rename(temporary_path, compiled_path)
+            except Exception:
+                # e.g. a read-only directory, the grammar will be loaded
+                # from the grammar file next time too
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+        return feature_grammar, allocator
+
+    @staticmethod
+    def preload(grammars, verbose=False):
+        """Load the given grammars at startup, so that no request has to.
+        @param grammars: C{list} of (grammar, DrtParser class) pairs
+        @return: C{list} of (grammar, DrtParser class, seconds) triples, the
+        time it took to load each grammar, next to nothing if it was loaded"""
+        report = []
+        for grammar, drt_parser in grammars:
+            started = time.time()
+            Tester.load_grammar(grammar, drt_parser)
+            report.append((grammar, drt_parser, time.time() - started))
+            if verbose:
+                print "%s (%s.%s): %.2f s" % (grammar, drt_parser.__module__, drt_parser.__name__, report[-1][2])
+        return report
 
     def _split(self, sentence):
         words = []
@@ -75,10 +234,17 @@ class Tester(object):
         return words
 
     def parse(self, text, **args):
+        """Parse a text in a session of its own (see L{presuppdrt.VariableAllocator}),
+        so that the same text always gives the same DRS"""
+        return in_session(VariableAllocator(self.allocator), self._parse, text, args)
+
+    def _parse(self, text, args):
         sentences = text.split('.')
         utter = args.get("utter", True)
         verbose = args.get("verbose", False)
-        drs = (utter and self.drt_parser.parse('DRS([n],[])')) or []
+        discourse = DiscourseBuilder()
+        if utter:
+            discourse.append(self.drt_parser.parse('DRS([n],[])'))
         
         for sentence in sentences:
             sentence = sentence.lstrip()
@@ -86,18 +252,16 @@ class Tester(object):
                 words = self._split(sentence)
                 if verbose:
                     print words
-                trees = self.parser.nbest_parse(words)
+                trees = self.parser.nbest_parse(words, args.get("parses", self.parses))
                 try:
                     new_drs = trees[0].node['SEM'].simplify()
                 except IndexError:
                     raise UngrammaticalException()
                 if verbose:
                     print(new_drs)
-                if drs:
-                    drs = (drs + new_drs).simplify()
-                else:
-                    drs = new_drs
-    
+                discourse.append(new_drs)
+
+        drs = discourse.drs() or []
         if verbose:
             print drs
         return drs
@@ -115,7 +279,7 @@ class Tester(object):
                 readings, errors = expression.resolve(lambda x: (True, None), verbose)
                 if len(expected_drs) == len(readings):
                     for index, pair in enumerate(zip(expected_drs, readings)):
-                        if pair[0] == pair[1]:
+                        if pair[0].equivalent(pair[1]):
                             print("%s. %s -- Reading (%s): %s\n" % (number, sentence, index + 1, pair[1]))
                         else:
                             print("%s. !!!failed reading (%s)!!!\n\n%s\n\nExpected:\t%s\n\nReturns:\t%s\n" %
@@ -128,12 +292,13 @@ class Tester(object):
                 else:
                     print("%s. !!!unexpected error!!!\n%s\n%s" % (number, sentence, e))
 
-    def interpret(self, expr_1, expr_2, background=None, verbose=False, test=False):
+    def interpret(self, expr_1, expr_2, background=None, verbose=False, test=False, schedule=None):
         """Interprets a new expression with respect to some previous discourse 
         and background knowledge. The function first generates relevant background
         knowledge and then performs inference check on readings generated by 
         the resolve() method. It returns a list of admissible interpretations in
-        the form of DRSs."""
+        the form of DRSs. The prover/builder budgets come from the given
+        L{inference.BudgetSchedule}, or from the default one."""
         
         assert(not expr_1 or isinstance(expr_1, str)), "Expression %s is not a string" % expr_1
         assert(isinstance(expr_2, str)), "Expression %s is not a string" % expr_2
@@ -146,7 +311,8 @@ class Tester(object):
                 discourse = None
                 expression = self.parse(expr_2, utter=True)
 
-            interpretations, errors = self.interpret_new(discourse, expression, background=background, verbose=verbose)
+            interpretations, errors = self.interpret_new(discourse, expression, background=background, verbose=verbose,
+                                                         schedule=schedule)
 
             if test:
                 return interpretations, errors
@@ -183,21 +349,32 @@ class Tester(object):
     def parse_new(self, discourse, expression_str):
         """parse the new expression and make sure that it has unique variables"""
         expression = self.parse(expression_str, utter=False)
-        for ref in set(expression.get_refs(True)) & set(discourse.get_refs(True)):
-            newref = DrtVariableExpression(unique_variable(ref))
-            expression = expression.replace(ref, newref, True)
-        return expression
+        # both are parsed in sessions of their own, the new variables
+        # must not occur in either of them
+        allocator = VariableAllocator(self.allocator)
+        allocator.reserve(discourse)
+        allocator.reserve(expression)
+        def rename():
+            return expression.replace_many(dict([(ref, DrtVariableExpression(unique_variable(ref)))
+                for ref in set(expression.get_refs(True)) & set(discourse.get_refs(True))]), True)
+        return in_session(allocator, rename)
 
-    def interpret_new(self, discourse, expression, background=None, verbose=False):
+    def interpret_new(self, discourse, expression, background=None, verbose=False, pool=None, executor=None,
+                      schedule=None):
         """Interprets a new expression with respect to some previous discourse 
         and background knowledge. The function first generates relevant background
         knowledge and then performs inference check on readings generated by 
         the resolve() method. It returns a list of admissible interpretations in
-        the form of DRSs."""
+        the form of DRSs. Prover checks run on the given L{inference.ProverPool}
+        or on the default one, with the budgets of the given L{inference.BudgetSchedule}
+        or of the default one; if an executor is given, readings are checked
+        concurrently on it (see L{presuppdrt.AbstractDrs.resolve})."""
+        assert executor is None or executor is not (pool or Theorem.default_pool()), \
+            "Readings cannot be checked on the pool the checks run on"
 
         try:
             if discourse:
-                new_discourse = (NewInfoDRS([], [expression]) + discourse).simplify()
+                new_discourse = simplified(NewInfoDRS([], [expression]) + discourse)
             else:
                 new_discourse = expression
 
@@ -206,7 +383,8 @@ class Tester(object):
             else:
                 background_knowledge = None
                     
-            return new_discourse.resolve(lambda x: inference_check(x, background_knowledge, verbose), verbose)
+            return new_discourse.resolve(lambda x: inference_check(x, background_knowledge, verbose, pool,
+                                                                   schedule=schedule), verbose, executor)
             
         except IndexError:
             print "Input sentences only!"
@@ -214,6 +392,26 @@ class Tester(object):
         except ValueError as e:
             print "Error: %s" % e
 
+    def iter_interpretations(self, discourse, expression, background=None, verbose=False, pool=None, limit=None,
+                             session=None, schedule=None):
+        """Like L{interpret_new}, but yields (reading, error) pairs as they are
+        checked instead of collecting all of them first, error being None for
+        admissible interpretations. Stops after limit admissible ones, if given
+        (see L{presuppdrt.AbstractDrs.iter_readings}). The checks build on the
+        discourse admitted to the given L{inference.InferenceSession}, if any."""
+        if discourse:
+            new_discourse = simplified(NewInfoDRS([], [expression]) + discourse)
+        else:
+            new_discourse = expression
+
+        if background:
+            background_knowledge = self.collect_background(new_discourse, background, verbose)
+        else:
+            background_knowledge = None
+
+        return new_discourse.iter_readings(lambda x: inference_check(x, background_knowledge, verbose, pool, session,
+                                                                     schedule=schedule), verbose, limit)
+
     def inference_test(self, cases, bk, verbose=False):
         for number, discourse, expression, judgement in cases:
             print "\n%s. %s %s" % (number, discourse, expression)
@@ -242,3 +440,14 @@ class Tester(object):
             
             else:
                 print "\nNo inadmissible readings"
+
+    def concatenation_test(self, cases):
+        """Checks that the concatenation of a discourse and a new expression,
+        parsed separately, binds every referent once"""
+        for number, discourse, expression in cases:
+            concatenation = (self.parse(discourse) + self.parse(expression, utter=False)).simplify()
+            refs = concatenation.get_refs(True)
+            if len(refs) == len(set(refs)):
+                print("%s. %s. %s. -- Referents: %s\n" % (number, discourse, expression, ",".join([str(ref) for ref in refs])))
+            else:
+                print("%s. !!!referents clash!!!\n\n%s. %s.\n\nReturns:\t%s\n" % (number, discourse, expression, concatenation))
@@ -65,9 +65,8 @@ class WordNetLookup(object):
 
 
 class DefiniteDescriptionDRS(drt.DefiniteDescriptionDRS):
-    def __init__(self, refs, conds):
-        self.wn = WordNetLookup()
-        super(drt.DefiniteDescriptionDRS, self).__init__(refs, conds)
+    # the lookup is shared, it is neither kept nor pickled with the DRS
+    wn = property(lambda self: WordNetLookup())
         
     def _strict_check (self, presupp_noun, other_cond):
         other_noun = other_cond.function.variable.name
@@ -0,0 +1,172 @@
+"""
+A fixed-size pool of long-lived worker threads with cancellable jobs
+"""
+
+import sys
+import atexit
+import threading
+from Queue import Queue
+
+class CancelledError(Exception):
+    pass
+
+class JobTimeoutError(Exception):
+    pass
+
+class Job(object):
+    """A function call submitted to a L{WorkerPool}. The result can be
+    collected with L{result()}; a job that is waiting or running can be
+    cancelled with L{cancel()}"""
+    def __init__(self, function, args=(), kwargs=None):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._running = False
+        self._cancelled = False
+        self._result = None
+        self._exc_info = None
+        self._done_callbacks = []
+        self._cancel_callbacks = []
+
+    def run(self):
+        self._lock.acquire()
+        try:
+            if self._cancelled:
+                return
+            self._running = True
+        finally:
+            self._lock.release()
+        try:
+            self._result = self.function(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._running = False
+            callbacks = self._done_callbacks
+            self._done_callbacks = []
+            self._done.set()
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            callback(self)
+
+    def cancel(self):
+        """Cancel the job. A job which has not started yet will never run,
+        a running job is notified through its cancel callbacks.
+        @return: C{boolean} False if the job had already finished"""
+        self._lock.acquire()
+        try:
+            if self._done.is_set():
+                return False
+            self._cancelled = True
+            running = self._running
+            callbacks = self._cancel_callbacks
+            self._cancel_callbacks = []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            callback()
+        if not running:
+            self._finish()
+        return True
+
+    def add_cancel_callback(self, callback):
+        """Register a function (without arguments) to be called when
+        the job is cancelled, e.g. to terminate a subprocess"""
+        self._lock.acquire()
+        try:
+            if not self._cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback()
+
+    def add_done_callback(self, callback):
+        """Register a function to be called with the job as its only
+        argument once the job has finished or has been cancelled"""
+        self._lock.acquire()
+        try:
+            if not self._done.is_set():
+                self._done_callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback(self)
+
+    def cancelled(self):
+        return self._cancelled
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job to finish and return its result.
+        @param timeout: maximum number of seconds to wait, or None
+        @raise JobTimeoutError: the job did not finish in time
+        @raise CancelledError: the job was cancelled"""
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise JobTimeoutError("Job did not finish in %s seconds" % timeout)
+        if self._cancelled:
+            raise CancelledError()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+class WorkerPool(object):
+    """A fixed number of daemon threads taking jobs from a common queue.
+    The threads are started once and reused for all submitted jobs."""
+
+    def __init__(self, size=4):
+        assert size > 0, "A pool needs at least one worker"
+        self.size = size
+        self._queue = Queue()
+        self._workers = []
+        for i in range(size):
+            worker = threading.Thread(target=self._work, name="%s-%s" % (self.__class__.__name__, i))
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+        # stop the workers before the interpreter starts tearing down modules
+        atexit.register(self.shutdown)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.run()
+
+    def submit(self, function, *args, **kwargs):
+        """Queue a function call and return its L{Job}"""
+        return self.submit_job(Job(function, args, kwargs))
+
+    def submit_job(self, job):
+        """Queue a job. A job submitted by one of the workers of the pool is
+        run right away instead: the worker would otherwise wait for a job
+        which may be queued behind it"""
+        if threading.currentThread() in self._workers:
+            job.run()
+        else:
+            self._queue.put(job)
+        return job
+
+    def pending(self):
+        """@return: the approximate number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True):
+        """Stop the workers once the jobs queued so far are done"""
+        for worker in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []